@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Project : PyvoA
+Date :    april 2020 - march 2025
+Authors : Olivier Dadoun, Julien Browaeys, Tristan Beau
+Copyright ©pyvoa_fr
+License: See joint LICENSE file
+https://pyvoa.org/
+
+Benchmark : fill_missing_dates
+
+About :
+-------
+
+Time of pyvoa.tools.fill_missing_dates on synthetic daily data with 10% of
+missing rows, for a growing number of locations, compared with the former
+implementation (one filter, reindex and concat per location).
+The time per output row of the current implementation should stay about
+constant (linear scaling), the former one grows with the number of locations.
+
+Usage:
+    python benchmarks/bench_fill_missing_dates.py [number of days]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from pyvoa.tools import fill_missing_dates
+
+def fill_missing_dates_loop(p, date_field='date', loc_field='where'):
+    ''' Former implementation, kept as a reference '''
+    p = p.loc[~p[loc_field].isin([''])]
+    idx = pd.date_range(p[date_field].min(), p[date_field].max(), freq = "D", name = date_field)
+    pfill = pd.DataFrame()
+    for l in list(p[loc_field].unique()):
+        pp = p.loc[p[loc_field]==l]
+        pp2 = pp.set_index([date_field])
+        pp2.index = pd.DatetimeIndex(pp2.index)
+        pp3 = pp2.reindex(idx, fill_value=pd.NA)
+        pp3[loc_field] = pp3[loc_field].fillna(l)
+        pfill = pd.concat([pfill, pp3])
+    pfill.reset_index(inplace=True)
+    return pfill
+
+def synthetic(nloc, ndays, nvar=10, seed=0):
+    ''' Daily data of nloc locations over ndays, 10% of the rows missing '''
+    rng = np.random.default_rng(seed)
+    p = pd.DataFrame({'date': np.tile(pd.date_range('2020-01-01', periods=ndays), nloc),
+        'where': pd.array(np.repeat(['L%03d'%i for i in range(nloc)], ndays), dtype='string')})
+    for i in range(nvar):
+        p['var%d'%i] = rng.random(len(p))
+    return p.loc[rng.random(len(p)) > 0.1].reset_index(drop=True)
+
+def timeit(func, p, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(p)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+if __name__ == '__main__':
+    ndays = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print('%8s %10s %12s %14s %12s %14s'%('nloc','rows','loop (s)','loop (us/row)','new (s)','new (us/row)'))
+    for nloc in [25, 50, 100, 200, 400]:
+        p = synthetic(nloc, ndays)
+        tnew, new = timeit(fill_missing_dates, p)
+        if nloc <= 200:
+            told, old = timeit(fill_missing_dates_loop, p, repeat=1)
+            pd.testing.assert_frame_equal(old, new)
+            loop = '%12.3f %14.2f'%(told, 1e6*told/len(new))
+        else:
+            loop = '%12s %14s'%('-', '-')
+        print('%8d %10d %s %12.3f %14.2f'%(nloc, len(new), loop, tnew, 1e6*tnew/len(new)))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Project : PyvoA
+Date :    april 2020 - march 2025
+Authors : Olivier Dadoun, Julien Browaeys, Tristan Beau
+Copyright ©pyvoa_fr
+License: See joint LICENSE file
+https://pyvoa.org/
+
+Benchmark : nonneg
+
+About :
+-------
+
+Time of pyvoa.datacube.nonneg (redistribution of the negative daily values
+of cumulative data, formerly computed by tools.getnonnegfunc) on synthetic cumulative
+data with 3% of negative corrections and 2% of missing values, for a growing
+number of locations, compared with the former implementation (one python
+loop per location and per negative value, summing again the values before
+it each time). The numba version is timed when numba is installed.
+All of them give the same values.
+
+Usage:
+    python benchmarks/bench_nonneg.py [number of days]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from pyvoa.datacube import nonneg, NUMBA_AVAILABLE
+
+def nonneg_loop(values):
+    ''' Former implementation, location by location, kept as a reference '''
+    result = np.empty(values.shape)
+    for l, x in enumerate(values):
+        whichvalues = pd.Series(x)
+        y0 = whichvalues.values[0]
+        if np.isnan(y0):
+            y0 = 0
+        pa = whichvalues.diff()
+        yy = pa.to_numpy(copy=True)
+        yy[np.isnan(yy)] = 0.
+        for kk in np.where(yy < 0)[0]:
+            k = int(kk)
+            val_to_repart = -yy[k]
+            if k < np.size(yy)-1:
+                yy[k] = (yy[k+1]+yy[k-1])/2
+            else:
+                yy[k] = yy[k-1]
+            val_to_repart = val_to_repart + yy[k]
+            s = np.nansum(yy[0:k])
+            if not any([i !=0 for i in yy[0:k]]) == True and s == 0:
+                yy[0:k] = 0.
+            elif s == 0:
+                yy[0:k] = np.nan*np.ones(k)
+            else:
+                yy[0:k] = yy[0:k]*(1-float(val_to_repart)/s)
+        result[l] = np.cumsum(yy)+y0
+    return result
+
+def synthetic(nloc, ndays, seed=0):
+    ''' Cumulative counts of nloc locations over ndays '''
+    rng = np.random.default_rng(seed)
+    daily = rng.poisson(20, (nloc, ndays)).astype(float)
+    corrections = rng.random((nloc, ndays)) < 0.03
+    daily[corrections] = -rng.integers(1, 200, corrections.sum())
+    values = np.cumsum(daily, axis=1)
+    values[rng.random((nloc, ndays)) < 0.02] = np.nan
+    return values
+
+def timeit(func, values, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(values)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+if __name__ == '__main__':
+    ndays = int(sys.argv[1]) if len(sys.argv) > 1 else 800
+    if NUMBA_AVAILABLE:
+        nonneg(synthetic(2, 10), jit=True) # compilation
+    print('%8s %10s %12s %14s %12s %14s %12s'%('nloc','values','loop (s)','loop (us/val)','batch (s)','batch (us/val)','numba (s)'))
+    for nloc in [10, 100, 1000, 5000]:
+        values = synthetic(nloc, ndays)
+        tnew, new = timeit(lambda v: nonneg(v, jit=False), values)
+        told, old = timeit(nonneg_loop, values, repeat=1)
+        np.testing.assert_array_equal(old, new)
+        loop = '%12.3f %14.2f'%(told, 1e6*told/values.size)
+        if NUMBA_AVAILABLE:
+            tjit, jit = timeit(lambda v: nonneg(v, jit=True), values)
+            np.testing.assert_array_equal(jit, new)
+            jit = '%12.3f'%tjit
+        else:
+            jit = '%12s'%'-'
+        print('%8d %10d %s %12.3f %14.2f %s'%(nloc, values.size, loop, tnew, 1e6*tnew/values.size, jit))
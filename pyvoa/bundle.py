@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Project : PyvoA
+Date :    april 2020 - march 2025
+Authors : Olivier Dadoun, Julien Browaeys, Tristan Beau
+Copyright ©pyvoa_fr
+License: See joint LICENSE file
+https://pyvoa.org/
+
+Module : pyvoa.bundle
+
+About :
+-------
+
+Offline snapshot bundles of all the sources a database needs.
+
+export_bundle() resolves every url used to build a database (csv files of the
+json description, country geometries, region pages, world geometry, population
+tables ...) and writes their content in one versioned tar file, together with a
+manifest. import_bundle() extracts such a file and points get_local_from_url at
+it, so that the database can then be loaded without any network access.
+
+Basic usage
+-----------
+On a computer with internet access:
+    import pyvoa.bundle as pb
+    pb.export_bundle('spf','spf.tar')
+
+On the offline computer:
+    import pyvoa.bundle as pb
+    pb.import_bundle('spf.tar')
+    import pyvoa.front as pv
+    pv.setwhom('spf')
+"""
+
+import os
+import io
+import json
+import tarfile
+import hashlib
+import datetime
+
+from pyvoa.tools import (
+    info,
+    verb,
+    record_urls,
+    open_local_file,
+    get_cache_folder,
+    get_offline_folders,
+    set_offline_folders,
+)
+from pyvoa.error import *
+from pyvoa.__version__ import __version__
+
+# version of the bundle layout, increased for any incompatible change
+_bundle_format = 1
+_manifest_name = 'manifest.json'
+_data_folder = 'data'
+
+def _get_content_sha256(filename):
+    """Return the sha256 of the content (uncompressed) of a local file
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    with open_local_file(filename) as fp:
+        for chunk in iter(lambda: fp.read(1024*1024), b''):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
+def export_bundle(db_name, filename=None):
+    '''
+        Build the database db_name, recording every url it needs, and write
+        the content of all of them in the tar file filename
+        (default pyvoa_<db_name>_<date>.tar) with a manifest listing for
+        each url: local file name, sha256 and size of the content.
+        Return the filename of the bundle.
+    '''
+    import pyvoa.geopd_builder as coco
+    if not filename:
+        filename = 'pyvoa_' + db_name + '_' + datetime.date.today().strftime('%Y%m%d') + '.tar'
+    with record_urls() as urls:
+        datab = coco.GPDBuilder(db_name)
+        # datasets are otherwise only downloaded when used
+        datab.get_parserdb().load_keywords()
+        # population tables are only requested with the bypop option
+        try:
+            pandy = datab.get_fulldb().drop_duplicates('where')
+            datab.normbypop(pandy, [datab.get_available_keywords()[0]], 'bypop=100k')
+        except:
+            info('No population data for ' + db_name + ', not included in the bundle.')
+
+    manifest = {
+        'format': _bundle_format,
+        'pyvoa_version': __version__,
+        'db': db_name,
+        'created': datetime.datetime.now().isoformat(),
+        'files': [],
+        }
+    with tarfile.open(filename, 'w') as tar:
+        for url, (local_filename, suffix) in sorted(urls.items()):
+            name = os.path.basename(local_filename)
+            sha, size = _get_content_sha256(local_filename)
+            tar.add(local_filename, arcname = _data_folder + '/' + name)
+            manifest['files'].append({'url': url, 'filename': name, 'suffix': suffix, 'sha256': sha, 'size': size})
+            verb('Bundle ' + filename + ' : adding ' + url)
+        content = json.dumps(manifest, indent=1).encode('utf-8')
+        tarinfo = tarfile.TarInfo(_manifest_name)
+        tarinfo.size = len(content)
+        tarinfo.mtime = int(datetime.datetime.now().timestamp())
+        tar.addfile(tarinfo, io.BytesIO(content))
+    info('Bundle of ' + db_name + ' written in ' + filename + ' (' + str(len(manifest['files'])) + ' sources).')
+    return filename
+
+def read_manifest(filename):
+    '''
+        Return the manifest of a bundle file as a dictionnary
+    '''
+    with tarfile.open(filename, 'r') as tar:
+        try:
+            fp = tar.extractfile(_manifest_name)
+        except KeyError:
+            raise PyvoaError(filename + ' is not a pyvoa bundle, no manifest found.')
+        manifest = json.load(fp)
+    if manifest.get('format', 0) > _bundle_format:
+        raise PyvoaError('Bundle ' + filename + ' format ' + str(manifest.get('format')) +
+            ' is too recent for this pyvoa version, please upgrade.')
+    return manifest
+
+def import_bundle(filename, folder=None, offline_only=True):
+    '''
+        Extract the bundle filename in folder (default in the local cache folder),
+        check the content of each source against the manifest and add it to the
+        offline folders used by get_local_from_url (see tools.set_offline_folders).
+        If offline_only is True (default) no network access is done anymore.
+        Return the manifest of the bundle.
+    '''
+    manifest = read_manifest(filename)
+    if folder is None:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        folder = os.path.join(get_cache_folder(), 'bundles', name)
+    os.makedirs(folder, exist_ok=True)
+    expected = {f['filename']: f for f in manifest['files']}
+    with tarfile.open(filename, 'r') as tar:
+        for member in tar.getmembers():
+            if member.name == _manifest_name:
+                continue
+            name = member.name[len(_data_folder)+1:]
+            if not member.isfile() or not member.name.startswith(_data_folder + '/') or name not in expected \
+                    or os.path.basename(name) != name:
+                raise PyvoaError('Unexpected file ' + member.name + ' in bundle ' + filename + '.')
+            local_filename = os.path.join(folder, name)
+            with tar.extractfile(member) as src, open(local_filename, 'wb') as dst:
+                for chunk in iter(lambda: src.read(1024*1024), b''):
+                    dst.write(chunk)
+            sha, size = _get_content_sha256(local_filename)
+            if sha != expected[name]['sha256'] or size != expected[name]['size']:
+                os.remove(local_filename)
+                raise PyvoaError('Corrupted content for ' + expected[name]['url'] + ' in bundle ' + filename + '.')
+    folders = [folder] + [f for f in get_offline_folders() if f != folder]
+    set_offline_folders(folders, offline_only)
+    info('Bundle of ' + manifest['db'] + ' (' + manifest['created'] + ') imported in ' + folder + '.')
+    return manifest
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Project : PyvoA
+Date :    april 2020 - march 2025
+Authors : Olivier Dadoun, Julien Browaeys, Tristan Beau
+Copyright ©pyvoa_fr
+License: See joint LICENSE file
+https://pyvoa.org/
+
+Module : pyvoa.datacube
+
+About :
+-------
+
+Dense storage of the data of a database: one contiguous float array indexed
+by (location, date, variable), with the dimension tables of the locations
+and of the dates.
+
+The functions of this module are the operations of GPDBuilder.get_stats done
+along the date axis of a (location, date) array: filling of the missing
+values, differences, rolling mean. They give the same values as the pandas
+groupby('where') versions on data sorted by date. nonneg is the
+redistribution of the negative daily values formerly computed by
+tools.getnonnegfunc, for all the locations at once (compiled with numba when it is installed).
+
+A cube can be written in a folder (values as a .npy file, dimension tables
+as json) and opened read-only with a memory map: processes opening the same
+folder share the values through the page cache of the OS.
+
+Basic usage
+-----------
+    import pyvoa.datacube as dc
+    cube = dc.DataCube.from_frame(pandas_db, ['tot_deaths'])
+    values = cube.get_values('tot_deaths', locations, 0, len(cube.dates))
+    cube.save(folder)
+    shared = dc.DataCube.open(folder)
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import shapely.wkb
+
+from pyvoa.error import *
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# version of the layout written by DataCube.save, increased for any incompatible change
+_cube_layout = 1
+
+def ffill(a):
+    '''
+        Forward fill of the missing values of a along the last axis
+    '''
+    index = np.where(np.isnan(a), 0, np.arange(a.shape[-1]))
+    np.maximum.accumulate(index, axis=-1, out=index)
+    return np.take_along_axis(a, index, axis=-1)
+
+def bfill(a):
+    '''
+        Backward fill of the missing values of a along the last axis
+    '''
+    return ffill(a[..., ::-1])[..., ::-1]
+
+def diff(a, k=1):
+    '''
+        a[t] - a[t-k] along the last axis, nan for the first k values
+    '''
+    d = np.full(a.shape, np.nan)
+    if k < a.shape[-1]:
+        d[..., k:] = a[..., k:] - a[..., :-k]
+    return d
+
+def rolling_mean(a, window):
+    '''
+        Mean of the window last values along the last axis, nan when one of
+        them is missing (as pandas rolling(window,min_periods=window))
+    '''
+    n = a.shape[-1]
+    m = np.full(a.shape, np.nan)
+    if window <= n:
+        s = np.zeros(a.shape[:-1] + (n-window+1,))
+        for i in range(window):
+            s += a[..., i:n-window+1+i]
+        m[..., window-1:] = s / window
+    return m
+
+def _pairwise_sum(a, lo, n):
+    '''
+        Sum of a[lo:lo+n] with the pairwise summation of numpy, so that the
+        compiled nonneg gives the same values as np.nansum
+    '''
+    if n < 8:
+        res = 0.
+        for i in range(lo, lo+n):
+            res += a[i]
+        return res
+    elif n <= 128:
+        r = a[lo:lo+8].copy()
+        i = 8
+        while i < n - (n % 8):
+            for j in range(8):
+                r[j] += a[lo+i+j]
+            i += 8
+        res = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+        while i < n:
+            res += a[lo+i]
+            i += 1
+        return res
+    n2 = n//2
+    n2 -= n2 % 8
+    return _pairwise_sum(a, lo, n2) + _pairwise_sum(a, lo+n2, n-n2)
+
+def _nonneg_rows(yy, neg):
+    '''
+        Location by location version of nonneg on the daily values yy, whose
+        negative ones are neg, done in place
+    '''
+    nloc, n = yy.shape
+    prefix = np.zeros(n)
+    for l in range(nloc):
+        for k in range(1, n):
+            if not neg[l, k]:
+                continue
+            val = -yy[l, k]
+            if k < n-1:
+                yy[l, k] = (yy[l, k+1] + yy[l, k-1])/2
+            else:
+                yy[l, k] = yy[l, k-1]
+            val = val + yy[l, k]
+            nonzero = False
+            for i in range(k):
+                nonzero = nonzero or yy[l, i] != 0
+                prefix[i] = 0. if np.isnan(yy[l, i]) else yy[l, i]
+            s = _pairwise_sum(prefix, 0, k)
+            if s == 0:
+                for i in range(k):
+                    yy[l, i] = np.nan if nonzero else 0.
+            else:
+                f = 1 - val/s
+                for i in range(k):
+                    yy[l, i] = yy[l, i]*f
+    return yy
+
+if NUMBA_AVAILABLE:
+    _pairwise_sum = numba.njit(cache=True)(_pairwise_sum)
+    _nonneg_rows = numba.njit(cache=True)(_nonneg_rows)
+
+def nonneg(a, jit=None):
+    '''
+        Remove the negative daily values of the cumulative values a
+        (location, date): each negative daily value,
+        in the order of the dates, is replaced by the mean of its neighbours
+        and the difference is taken off the daily values before it, in
+        proportion. Missing daily values count as 0, the first value is the
+        offset. Return the corrected cumulative values.
+        All the locations are processed together, one step per date with a
+        negative value; with jit (default when numba is installed) the
+        compiled location by location version is used. Both give the same
+        values as the former loop of getnonnegfunc.
+    '''
+    a = np.atleast_2d(np.asarray(a, dtype=float))
+    n = a.shape[1]
+    if n == 0:
+        return a.copy()
+    y0 = np.where(np.isnan(a[:, 0]), 0., a[:, 0])
+    yy = np.nan_to_num(diff(a), nan=0., posinf=np.inf, neginf=-np.inf)
+    neg = yy < 0
+    if jit is None:
+        jit = NUMBA_AVAILABLE
+    if jit:
+        _nonneg_rows(yy, neg)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for k in np.flatnonzero(neg.any(axis=0)):
+                m = np.flatnonzero(neg[:, k])
+                val = -yy[m, k]
+                if k < n-1:
+                    yy[m, k] = (yy[m, k+1] + yy[m, k-1])/2
+                else:
+                    yy[m, k] = yy[m, k-1]
+                val = val + yy[m, k]
+                prefix = yy[m, :k]
+                s = np.nansum(prefix, axis=1)[:, None]
+                # all zero: set to 0, zero sum: no value, else in proportion
+                zero = np.where((prefix != 0).any(axis=1)[:, None], np.nan, 0.)
+                yy[m, :k] = np.where(s == 0, zero, prefix*(1 - val[:, None]/s))
+    return np.cumsum(yy, axis=1) + y0[:, None]
+
+class DataCube:
+    '''
+        Data of a database as values[location, date, variable], with
+        - locations: a pandas (where, code, geometry), one row per location in
+          their order of appearance in the data
+        - dates: the dates of the data, every step days
+    '''
+    def __init__(self, values, locations, dates, keywords, step=1, wherecategories=None, codecategories=None):
+        self.values = values
+        self.locations = locations
+        self.dates = dates
+        self.keywords = list(keywords)
+        self.step = step
+        self.wherecategories = wherecategories
+        self.codecategories = codecategories
+
+    @classmethod
+    def from_frame(cls, pandas_db, keywords, step=1):
+        '''
+            Build the cube of the variables keywords of pandas_db, a pandas
+            with the columns date, where, code, geometry and the variables,
+            as given by DataParser.get_maingeopandas
+        '''
+        codes, uniques = pd.factorize(pandas_db['code'])
+        if (codes < 0).any():
+            raise PyvoaError('DataCube: missing location code in the data.')
+        first = pd.Series(np.arange(len(codes))).groupby(codes).first().values
+        locations = pd.DataFrame({
+            'where': pandas_db['where'].astype(object).values[first],
+            'code': pandas_db['code'].astype(object).values[first],
+            'geometry': pandas_db['geometry'].values[first] if 'geometry' in pandas_db.columns else None,
+            })
+        date = pd.to_datetime(pandas_db['date'])
+        d0 = date.min()
+        days = ((date - d0).dt.days // step).to_numpy()
+        ndates = int(days.max()) + 1 if len(days) else 0
+        dates = pd.DatetimeIndex(d0 + pd.to_timedelta(np.arange(ndates)*step, unit='D'))
+        values = np.full((len(locations), ndates, len(keywords)), np.nan)
+        values[codes, days, :] = pandas_db[keywords].to_numpy(dtype=float)
+        categories = {}
+        for c in ['where', 'code']:
+            if isinstance(pandas_db[c].dtype, pd.CategoricalDtype):
+                categories[c] = list(pandas_db[c].cat.categories)
+            else:
+                categories[c] = sorted(locations[c].dropna().unique())
+        return cls(values, locations, dates, keywords, step, categories['where'], categories['code'])
+
+    def get_values(self, which, locations, i0, i1):
+        '''
+            Return a copy of the values of the variable which, for the
+            locations (list of location indices) and the dates i0 to i1 (excluded),
+            as a (location, date) array
+        '''
+        if which not in self.keywords:
+            raise PyvoaKeyError('DataCube: ' + str(which) + ' is not a variable of the cube.')
+        j = self.keywords.index(which)
+        return np.ascontiguousarray(self.values[locations, i0:i1, j])
+
+    def get_location_index(self, where):
+        '''
+            Return the indices of the locations whose name is in the list
+            where, upper str comparision to be insensitive case, in the
+            order of the locations of the cube
+        '''
+        upperwhere = set(x.upper() for x in where)
+        names = self.locations['where'].astype(str).str.upper()
+        return np.flatnonzero(names.isin(upperwhere).to_numpy() & self.locations['where'].notna().to_numpy())
+
+    def get_date_slice(self, beg, end):
+        '''
+            Return the indices (i0, i1) of the dates between beg and end included
+        '''
+        i0 = self.dates.searchsorted(pd.to_datetime(beg), side='left')
+        i1 = self.dates.searchsorted(pd.to_datetime(end), side='right')
+        return i0, i1
+
+    def nbytes(self):
+        '''
+            Memory size of the values of the cube
+        '''
+        return self.values.nbytes
+
+    def save(self, folder):
+        '''
+            Write the cube in folder: values.npy for the values, cube.json for
+            the dimension tables (geometries as WKB), see open
+        '''
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, 'values.npy'), np.ascontiguousarray(self.values, dtype=float))
+        geometry = [None if g is None or (isinstance(g, float) and np.isnan(g)) else shapely.wkb.dumps(g, hex=True)
+                    for g in self.locations['geometry']]
+        description = {
+            'layout': _cube_layout,
+            'keywords': self.keywords,
+            'step': int(self.step),
+            'dates': [d.strftime('%Y-%m-%d') for d in self.dates],
+            'where': [None if pd.isna(w) else w for w in self.locations['where']],
+            'code': [None if pd.isna(c) else c for c in self.locations['code']],
+            'geometry': geometry,
+            'wherecategories': list(self.wherecategories),
+            'codecategories': list(self.codecategories),
+            }
+        # json last: it marks the cube as complete
+        with open(os.path.join(folder, 'cube.json'), 'w') as fp:
+            json.dump(description, fp)
+
+    @classmethod
+    def open(cls, folder):
+        '''
+            Open the cube written by save in folder. The values are a read-only
+            memory map of the file: they are not loaded in memory, and they
+            are shared by all the processes opening the same folder.
+        '''
+        try:
+            with open(os.path.join(folder, 'cube.json'), 'r') as fp:
+                description = json.load(fp)
+        except (OSError, ValueError):
+            raise PyvoaError('DataCube: no cube stored in ' + folder + '.')
+        if description.get('layout') != _cube_layout:
+            raise PyvoaError('DataCube: cube in ' + folder + ' stored with an other layout, it must be written again.')
+        values = np.load(os.path.join(folder, 'values.npy'), mmap_mode='r')
+        locations = pd.DataFrame({
+            'where': description['where'],
+            'code': description['code'],
+            'geometry': [None if g is None else shapely.wkb.loads(g, hex=True) for g in description['geometry']],
+            })
+        dates = pd.DatetimeIndex(pd.to_datetime(description['dates']))
+        return cls(values, locations, dates, description['keywords'], description['step'],
+            description['wherecategories'], description['codecategories'])
+
+    def to_frame(self):
+        '''
+            Return the data of the cube as a pandas
+            |date|where|code| var-1 ... var-n| geometry
+            sorted by location then date, as the one of from_frame
+        '''
+        nloc, nd = self.values.shape[:2]
+        pandas_db = pd.DataFrame({
+            'date': np.tile(self.dates.values, nloc),
+            'where': pd.Categorical(np.repeat(self.locations['where'].values, nd), categories = self.wherecategories),
+            'code': pd.Categorical(np.repeat(self.locations['code'].values, nd), categories = self.codecategories),
+            })
+        for j, w in enumerate(self.keywords):
+            pandas_db[w] = np.array(self.values[:, :, j]).ravel()
+        pandas_db['geometry'] = np.repeat(self.locations['geometry'].values, nd)
+        return pandas_db
@@ -129,10 +129,19 @@ class front:
 
         By default, the listbase()[0] is the default base used in other
         functions.
+        engine = 'cube' computes get/plot/map on a dense array of the data
+        instead of the pandas (default 'pandas').
+        shared = True opens the data written once for all processes (see
+        GPDBuilder.writeshared) instead of parsing or unpickling them, with
+        the 'cube' engine.
         """
         reload = kwargs.get('reload', True)
+        shared = kwargs.get('shared', False)
         if reload not in [0,1]:
             raise PyvoaError('reload must be a boolean ... ')
+        engine = kwargs.get('engine', 'cube' if shared else 'pandas')
+        if engine not in coco.GPDBuilder.engines:
+            raise PyvoaError('engine must be one of ' + str(coco.GPDBuilder.engines))
         if base not in self.listwhom():
             raise PyvoaDbError(base + ' is not a supported GPDBuilder. '
                                     'See pycoa.listbase() for the full list.')
@@ -140,15 +149,20 @@ class front:
         visu = self.getdisplay()
         if self.db == base:
             info(f"The GPDBuilder '{base}' is already set as the current database")
+            self.gpdbuilder.setengine(engine)
             return
         else:
-            if reload:
+            if shared:
+                self.gpdbuilder = coco.GPDBuilder.readshared(base)
+                self.allvisu = AllVisu(base, self.gpdbuilder.getwheregeometrydescription())
+            elif reload:
                 self.gpdbuilder, self.allvisu = coco.GPDBuilder.factory(db_name=base,reload=reload,vis=visu)
             else:
                 self.gpdbuilder = coco.GPDBuilder.readpkl('.cache/'+base+'.pkl')
                 pandy = self.gpdbuilder.getwheregeometrydescription()
                 self.allvisu = AllVisu(base, pandy)
                 coge.GeoManager('name')
+        self.gpdbuilder.setengine(engine)
         self.db = base
 
     def input_wrapper(func):
@@ -188,7 +202,8 @@ class front:
                     kwargs[k]=v[0]
 
             if kwargs['where'][0] == '':
-                kwargs['where'] = list(self.gpdbuilder.get_fulldb()['where'].unique())
+                which = [w for w in kwargs['which'] if w] or self.gpdbuilder.get_available_keywords()[:1]
+                kwargs['where'] = list(self.gpdbuilder.get_fulldb(which)['where'].unique())
 
             if not all_or_none_lists(kwargs['where']):
                 raise PyvoaError('For coherence all the element in where must have the same type list or not list ...')
@@ -40,7 +40,7 @@ import bs4
 import numpy as np
 import io
 
-from pyvoa.tools import verb,kwargs_test,get_local_from_url,dotdict,tostdstring
+from pyvoa.tools import verb,kwargs_test,get_local_from_url,open_local_file,get_gdal_path,dotdict,tostdstring
 from pyvoa.error import *
 
 # ---------------------------------------------------------------------
@@ -475,7 +475,8 @@ class GeoInfo():
                         ) # containts tuples with position in table, name of column, new name of field
 
                     # get data with cache ok for about 1 month
-                    self._data_population = pd.read_html(get_local_from_url('https://www.worldometers.info/world-population/population-by-country/',30e5) ) [0].iloc[:,[x[0] for x in field_descr]]
+                    with open_local_file(get_local_from_url('https://www.worldometers.info/world-population/population-by-country/',30e5)) as fp:
+                        self._data_population = pd.read_html(fp) [0].iloc[:,[x[0] for x in field_descr]]
 
                     # test that field order hasn't changed in the db
                     if not all (col.startswith(field_descr[i][1]) for i,col in enumerate(self._data_population.columns) ):
@@ -527,7 +528,7 @@ class GeoInfo():
                     #self._data_geometry=self._data_geometry.append({'id_tmp':'SSD','geometry':None},ignore_index=True) # adding the SSD row
                     #self._data_geometry=pd.concat([self._data_geometry,pd.DataFrame({'id_tmp':'SSD','geometry':None})])
                     for newc in ['SSD','SDN']:
-                        newgeo=gpd.read_file(get_local_from_url('https://github.com/johan/world.geo.json/raw/master/countries/'+newc+'.geo.json'))
+                        newgeo=gpd.read_file(get_gdal_path(get_local_from_url('https://github.com/johan/world.geo.json/raw/master/countries/'+newc+'.geo.json')))
                         poly=newgeo[newgeo.id==newc].geometry.values[0]
                         self._data_geometry.loc[self._data_geometry.id_tmp==newc,'geometry']=gpd.GeoSeries(poly).values
 
@@ -550,7 +551,8 @@ class GeoInfo():
             # -----------------------------------------------------------
             elif f == 'flag':
                 if self._data_flag.empty:
-                    self._data_flag = pd.read_json(get_local_from_url('https://github.com/linssen/country-flag-icons/raw/master/countries.json',0))
+                    with open_local_file(get_local_from_url('https://github.com/linssen/country-flag-icons/raw/master/countries.json',0)) as fp:
+                        self._data_flag = pd.read_json(fp)
                     self._data_flag['flag_url']='http:'+self._data_flag['file_url']
 
                 p=p.merge(self._data_flag[['alpha3','flag_url']],how='left',\
@@ -604,7 +606,8 @@ class GeoRegion():
 
         verb("Init of GeoRegion() from "+str(inspect.stack()[1]))
 
-        p_m49=pd.read_html(get_local_from_url(self._source_dict["UN_M49"],0))[1]
+        with open_local_file(get_local_from_url(self._source_dict["UN_M49"],0)) as fp:
+            p_m49=pd.read_html(fp)[1]
 
         p_m49.columns=['code','region_name']
         p_m49['region_name']=[r.split('(')[0].rstrip().title() for r in p_m49.region_name]  # suppress information in parenthesis in region name
@@ -630,44 +633,53 @@ class GeoRegion():
                                     })  # add UE for other analysis
 
         # --- filling cw information
-        p_cw=pd.read_html(get_local_from_url('https://en.wikipedia.org/w/index.php?title=Member_states_of_the_Commonwealth_of_Nations&oldid=1090420488'))
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/w/index.php?title=Member_states_of_the_Commonwealth_of_Nations&oldid=1090420488')) as fp:
+            p_cw=pd.read_html(fp)
         self._cw=[w.split('[')[0] for w in p_cw[0]['Country'].to_list()]   # removing wikipedia notes
 
         # --- filling celac information
-        p_celac=pd.read_html(get_local_from_url('https://en.wikipedia.org/wiki/Community_of_Latin_American_and_Caribbean_States'),\
-                    match='Country')
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/wiki/Community_of_Latin_American_and_Caribbean_States')) as fp:
+            p_celac=pd.read_html(fp,match='Country')
         self._celac = [p_celac[0].Country.to_list()]
 
         # --- filling cedeao information
-        p_cedeao=pd.read_html(get_local_from_url('https://en.wikipedia.org/wiki/Economic_Community_of_West_African_States'))
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/wiki/Economic_Community_of_West_African_States')) as fp:
+            p_cedeao=pd.read_html(fp)
         self._cedeao=["Cabo Verde" if x=="Cape Verde" else "CIV" if x=="Ivory Pyvoast" else x for x in pd.concat([p_cedeao[1][0:-1],p_cedeao[2][0:-1]]).Country.to_list()]
 
         # --- filling sadc information
-        p_sadc=pd.read_html(get_local_from_url('https://en.wikipedia.org/wiki/Southern_African_Development_Community'))
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/wiki/Southern_African_Development_Community')) as fp:
+            p_sadc=pd.read_html(fp)
         self._sadc=["COD" if x == "Democratic Republic of the Congo" else x for x in [w.split('[')[0] for w in p_sadc[2][p_sadc[2].columns[0]].to_list()]]
 
         # --- filling amu information
-        p_amu=pd.read_html(get_local_from_url('https://en.wikipedia.org/wiki/Arab_Maghreb_Union'))
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/wiki/Arab_Maghreb_Union')) as fp:
+            p_amu=pd.read_html(fp)
         self._amu=p_amu[2].Country.to_list()[0:-1]
 
         # --- filling ceeac information
-        p_ceeac=pd.read_html(get_local_from_url('https://en.wikipedia.org/wiki/Economic_Community_of_Central_African_States'))
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/wiki/Economic_Community_of_Central_African_States')) as fp:
+            p_ceeac=pd.read_html(fp)
         self._ceeac=["COD" if w == "Democratic Republic of the Congo" else w for w in [x.split('[')[0] for x in p_ceeac[3].Country.to_list()]]
 
         # --- filling eac information
-        p_eac=pd.read_html(get_local_from_url('https://en.wikipedia.org/wiki/East_African_Community'))
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/wiki/East_African_Community')) as fp:
+            p_eac=pd.read_html(fp)
         self._eac=["COD" if x == "DR Congo" else x for x in p_eac[1].Country.to_list()[0:-1]]
 
         # --- filling censad information
-        p_censad=pd.read_html(get_local_from_url('https://en.wikipedia.org/wiki/Community_of_Sahel%E2%80%93Saharan_States'))
+        with open_local_file(get_local_from_url('https://en.wikipedia.org/wiki/Community_of_Sahel%E2%80%93Saharan_States')) as fp:
+            p_censad=pd.read_html(fp)
         self._censad=["Cabo Verde" if x == "Cape Verde" else "CIV" if x == "Ivory Pyvoast" else x.split('[')[0] for x in p_censad[3][p_censad[3].columns[0]].to_list()[0:-1]]
 
         # --- filing comesa information
-        p_comesa=pd.read_html(get_local_from_url('https://www.worlddata.info/trade-agreements/comesa.php'))
+        with open_local_file(get_local_from_url('https://www.worlddata.info/trade-agreements/comesa.php')) as fp:
+            p_comesa=pd.read_html(fp)
         self._comesa=["COD" if x == "Congo (Dem. Republic)" else x for x in p_comesa[0].Country.to_list()]
 
         # --- get the UnitedNation GeoScheme and organize the data
-        p_gs=pd.read_html(get_local_from_url(self._source_dict["GeoScheme"],0))[0]
+        with open_local_file(get_local_from_url(self._source_dict["GeoScheme"],0)) as fp:
+            p_gs=pd.read_html(fp)[0]
         p_gs.columns=['country','capital','iso2','iso3','num','m49']
         p_gs=pd.concat([p_gs,pd.DataFrame({'country':'Taiwan','iso2':'TW','iso3':'TWN','num':'158','m49':'030 < 0142 < 001'},index=[0])],ignore_index=True)
         #p_gs=p_gs.append({'country':'Taiwan','iso2':'TW','iso3':'TWN','num':'158','m49':'030 < 0142 < 001'},ignore_index=True)
@@ -863,7 +875,7 @@ class GeoCountry():
         # --- 'FRA' case ---------------------------------------------------------------------------------------
         if self._country=='FRA':
             #self._country_data = gpd.read_file('zip://'+get_local_from_url(url,0,'.zip'))
-            self._country_data = gpd.read_file(get_local_from_url(url,0))
+            self._country_data = gpd.read_file(get_gdal_path(get_local_from_url(url,0)))
 
             # adding a flag for subregion (departements)
             self._country_data['flag_subregion']=self._source_dict['FRA']['Subregion Flags']+'img/dept/sticker_plaque_immat_'+\
@@ -871,10 +883,8 @@ class GeoCountry():
                 [n.lower() for n in self._country_data['dep_name']]+'_moto.png' # picture of a sticker for motobikes, not so bad...
 
             # Reading information to get region flags and correct names of regions
-            f_reg_flag=open(get_local_from_url(self._source_dict['FRA']['Region Flags'],0), 'r', encoding="utf8")
-
-            content_reg_flag = f_reg_flag.read()
-            f_reg_flag.close()
+            with open_local_file(get_local_from_url(self._source_dict['FRA']['Region Flags'],0), 'r', encoding="utf8") as f_reg_flag:
+                content_reg_flag = f_reg_flag.read()
             soup_reg_flag = bs4.BeautifulSoup(content_reg_flag,'lxml')
             for img in soup_reg_flag.find_all('img'):  # need to convert <img tags to pyvoa content for pandas_read
                 pyvoa=img.get('pyvoa')
@@ -903,7 +913,8 @@ class GeoCountry():
                 },inplace=True)
 
             # adding population information (departements)
-            pop_fra = pd.read_html(get_local_from_url(self._source_dict['FRA']['Population']))[0]
+            with open_local_file(get_local_from_url(self._source_dict['FRA']['Population'])) as fp:
+                pop_fra = pd.read_html(fp)[0]
             pop_fra['population_subregion']=pop_fra['Population municipale'].str.replace(r"[ \xa0]","",regex=True).astype(int)
             # En l'absence de Mayotte dans ce document, car le recensement n'a pas eu lieu en phase, ajout à la main
             # En référence à la page pour Mayotte : https://www.insee.fr/fr/statistiques/3291775?sommaire=2120838
@@ -946,9 +957,8 @@ class GeoCountry():
             self._country_data.drop(['DRAWSEQ','STATE_FIPS'],axis=1,inplace=True)
 
             # Adding informations from wikipedia
-            f_us=open(get_local_from_url(self._source_dict['USA']['Subregion informations'],0), 'r')
-            content_us = f_us.read()
-            f_us.close()
+            with open_local_file(get_local_from_url(self._source_dict['USA']['Subregion informations'],0), 'r') as f_us:
+                content_us = f_us.read()
             soup_us = bs4.BeautifulSoup(content_us,'lxml')
             for img in soup_us.find_all('img'):  # need to convert <img tags to pyvoa content for pandas_read
                 pyvoa=img.get('pyvoa')
@@ -969,7 +979,7 @@ class GeoCountry():
 
         # --- 'ITA' case ---------------------------------------------------------------------------------------
         elif self._country == 'ITA':
-            self._country_data = gpd.read_file(get_local_from_url(url,0)) # this is a geojson file
+            self._country_data = gpd.read_file(get_gdal_path(get_local_from_url(url,0))) # this is a geojson file
             self._country_data.rename(columns={\
                 'prov_name':'name_subregion',\
                 'prov_acr':'code_subregion',\
@@ -984,7 +994,7 @@ class GeoCountry():
 
         # --- 'IND' case ---------------------------------------------------------------------------------------
         elif self._country == 'IND':
-            self._country_data = gpd.read_file(get_local_from_url(url,0)) # this is a geojson file
+            self._country_data = gpd.read_file(get_gdal_path(get_local_from_url(url,0))) # this is a geojson file
             self._country_data.rename(columns={\
                 'NAME_1':'name_subregion',\
                 'VARNAME_1':'variationname',\
@@ -1003,7 +1013,7 @@ class GeoCountry():
 
         # --- 'DEU' case ---------------------------------------------------------------------------------------
         elif self._country == 'DEU':
-            self._country_data = gpd.read_file(get_local_from_url(url,0)) # this is a geojson file
+            self._country_data = gpd.read_file(get_gdal_path(get_local_from_url(url,0))) # this is a geojson file
             self._country_data.rename(columns={\
                 'GEN':'name_subregion',\
                 'AGS':'code_subregion',\
@@ -1011,7 +1021,8 @@ class GeoCountry():
                 inplace=True)
             # See https://www.ioer-monitor.de/en/methodology/glossary/o/official-municipality-key-ags/ for decoding information of region code
             self._country_data['code_region'] = (self._country_data.code_subregion.astype(int)//1000).astype(str).str.zfill(2)
-            h_deu=pd.read_html(get_local_from_url('https://de.zxc.wiki/wiki/Amtlicher_Gemeindeschl%C3%BCssel',0))[3]
+            with open_local_file(get_local_from_url('https://de.zxc.wiki/wiki/Amtlicher_Gemeindeschl%C3%BCssel',0)) as fp:
+                h_deu=pd.read_html(fp)[3]
             h_deu['id']=h_deu['#'].str.slice(stop=2)
             h_deu['name_region']=h_deu['country']
             self._country_data=self._country_data.merge(h_deu,how='left',left_on='code_region',right_on='id')
@@ -1034,8 +1045,9 @@ class GeoCountry():
 
         # --- 'GBR' case ---------------------------------------------------------------------------------------
         elif self._country == 'GBR':
-            self._country_data = gpd.read_file(get_local_from_url(url,0))
-            reg_england=pd.read_csv(get_local_from_url(self._source_dict['GBR']['Regions'],0))
+            self._country_data = gpd.read_file(get_gdal_path(get_local_from_url(url,0)))
+            with open_local_file(get_local_from_url(self._source_dict['GBR']['Regions'],0)) as fp:
+                reg_england=pd.read_csv(fp)
             reg_adding_dict={
                 'E07000245':('E12000006','East of England'), # West Suffolk in East of England
                 'E07000244':('E12000006','East of England'), # East Suffolk in East of England
@@ -1132,7 +1144,7 @@ class GeoCountry():
 
         # --- 'EUR' case, which is a pseudo country for Europe ---------------------------------------------------------
         elif self._country == 'EUR':
-            self._country_data=gpd.read_file(get_local_from_url(url,0))
+            self._country_data=gpd.read_file(get_gdal_path(get_local_from_url(url,0)))
             self._country_data.rename(columns={\
                 'UID':'code_subregion',\
                 'RegionName':'name_subregion',\
@@ -1165,7 +1177,7 @@ class GeoCountry():
 
         #--- 'JPN' case ----------------------------------------------------------------------------------------
         elif self._country == 'JPN':
-            self._country_data = gpd.read_file('https://raw.githubusercontent.com/dataofjapan/land/master/japan.geojson')
+            self._country_data = gpd.read_file(get_gdal_path(get_local_from_url('https://raw.githubusercontent.com/dataofjapan/land/master/japan.geojson',0)))
             np_name_subregion_jpn = np.array(['Hokkaido', 'Aomori', 'Iwate', 'Miyagi', 'Akita',\
                                               'Yamagata', 'Fukushima', 'Ibaraki', 'Tochigi',\
                                               'Gunma', 'Saitama','Chiba', 'Tokyo', 'Kanagawa',\
@@ -29,24 +29,33 @@ from pyvoa.tools import (
     debug,
     verb,
     flat_list,
-    getnonnegfunc,
     return_nonan_dates_pandas,
 )
 import pyvoa.geo as coge
 
 import pyvoa.jsondb_parser as parser
+import pyvoa.datacube as dc
+from pyvoa.statscache import StatsCache
 
 import geopandas as gpd
 from pyvoa.error import *
 import pickle
+import copy
 import os, time
 import re
+import json
 import pyvoa.geo as coge
 from pyvoa.kwarg_options import InputOption
 class GPDBuilder(object):
    """
    GPDBuilder class
    """
+   # get_stats computed on the long pandas ('pandas') or on the DataCube of the db ('cube')
+   engines = ['pandas','cube']
+   engine = 'pandas'
+   # results of get_stats, created when first used, see getstatscache
+   statscache = None
+
    def __init__(self, db_name):
         """
             Main pycoa.class:
@@ -59,7 +68,6 @@ class GPDBuilder(object):
         self.currentmetadata = parser.MetaInfo().getcurrentmetadata(db_name)
         self.currentdata = parser.DataParser(db_name)
 
-        self.slocation = self.currentdata.get_locations()
         #self.geo = self.currentdata.get_geo()
         self.db_world = self.currentdata.get_world_boolean()
         self.codisp  = None
@@ -67,22 +75,29 @@ class GPDBuilder(object):
         self.granularity = self.currentmetadata['geoinfo']['granularity']
         self.namecountry = self.currentmetadata['geoinfo']['iso3']
         self._gi = coge.GeoInfo()
+        self.set_geodescription()
+
 
+   def set_geodescription(self):
+        """
+            Build the geo methods of the db (geo) and the description of the
+            geometry of its locations (where_geodescription)
+        """
         try:
             if self.granularity == 'country':
-                   self.geo = coge.GeoManager('name')
+                   self._geo = coge.GeoManager('name')
                    geopan = gpd.GeoDataFrame()#crs="EPSG:4326")
                    info = coge.GeoInfo()
-                   allcountries = self.geo.get_GeoRegion().get_countries_from_region('world')
-                   geopan['where'] = [self.geo.to_standard(c)[0] for c in allcountries]
+                   allcountries = self._geo.get_GeoRegion().get_countries_from_region('world')
+                   geopan['where'] = [self._geo.to_standard(c)[0] for c in allcountries]
                    geopan = info.add_field(field=['geometry'],input=geopan ,geofield='where')
                    geopan = gpd.GeoDataFrame(geopan, geometry=geopan.geometry, crs="EPSG:4326")
                    geopan = geopan[geopan['where'] != 'Antarctica']
                    where_kindgeo = geopan.dropna().reset_index(drop=True)
             else:
-                   self.geo = coge.GeoCountry(self.code)
+                   self._geo = coge.GeoCountry(self.code)
                    if self.granularity == 'region':
-                        where_kindgeo = self.geo.get_region_list()[['code_region', 'name_region', 'geometry']]
+                        where_kindgeo = self._geo.get_region_list()[['code_region', 'name_region', 'geometry']]
                         where_kindgeo = where_kindgeo.rename(columns={'name_region': 'where'})
                         if self.code == 'PRT':
                              tmp = where_kindgeo.rename(columns={'name_region': 'where'})
@@ -94,13 +109,36 @@ class GPDBuilder(object):
                              self.boundary_metropole =tmp['geometry'].total_bounds
                    elif self.granularity == 'subregion':
                         list_dep_metro = None
-                        where_kindgeo = self.geo.get_subregion_list()[['code_subregion', 'name_subregion', 'geometry']]
+                        where_kindgeo = self._geo.get_subregion_list()[['code_subregion', 'name_subregion', 'geometry']]
                         where_kindgeo = where_kindgeo.rename(columns={'name_subregion': 'where'})
                    else:
                        raise PyvoaTypeError('What is the granularity of your  database ?')
         except:
             raise PyvoaTypeError('What data base are you looking for ?')
-        self.where_geodescription = where_kindgeo
+        self._where_geodescription = where_kindgeo
+
+   @property
+   def geo(self):
+       ''' geo methods of the db, built when first used '''
+       if getattr(self, '_geo', None) is None:
+           self.set_geodescription()
+       return self._geo
+
+   @geo.setter
+   def geo(self, geo):
+       self._geo = geo
+
+   @property
+   def where_geodescription(self):
+       ''' geometry of the locations of the db, built when first used '''
+       if getattr(self, '_where_geodescription', None) is None:
+           self.set_geodescription()
+       return self._where_geodescription
+
+   @property
+   def slocation(self):
+       ''' locations of the datasets parsed so far, updated as datasets are loaded '''
+       return self.currentdata.get_locations()
 
    @staticmethod
    def dictbypop():
@@ -175,6 +213,59 @@ class GPDBuilder(object):
              datab.get_parserdb().get_echoinfo()
       return datab
 
+   def writeshared(self, folder = None):
+      '''
+        Write the data of the db in folder (default
+        DataParser.get_shared_folder) to be opened by readshared in other
+        processes, see DataParser.write_shared.
+        The GPDBuilder without its data nor geometries (rebuilt when used) is
+        stored in builder.pkl, written last: readshared relies on it.
+      '''
+      folder = folder or parser.DataParser.get_shared_folder(self.db)
+      os.makedirs(folder, exist_ok=True)
+      path = self.currentdata.write_shared(folder)
+      datab = copy.copy(self)
+      datab.currentdata = None
+      datab.codisp = None
+      datab._geo, datab._where_geodescription, datab._gi = None, None, None
+      filepkl = os.path.join(folder, 'builder.pkl')
+      with open(filepkl + '.%d'%os.getpid(), 'wb') as f:
+          pickle.dump(datab, f)
+      os.replace(filepkl + '.%d'%os.getpid(), filepkl)
+      return path
+
+   @staticmethod
+   def readshared(db_name, folder = None):
+      '''
+        Return the GPDBuilder of db_name written by writeshared in folder
+        (default DataParser.get_shared_folder), written first if needed.
+        Its data are memory maps shared by all the processes reading them,
+        get_stats is done by the 'cube' engine (see setengine).
+      '''
+      folder = folder or parser.DataParser.get_shared_folder(db_name)
+      filepkl = os.path.join(folder, 'builder.pkl')
+      if not os.path.isfile(filepkl):
+         PyvoaWarning("Shared data of "+db_name + " isn't allready stored")
+         GPDBuilder(db_name).writeshared(folder)
+      with open(filepkl, 'rb') as f:
+         datab = pickle.load(f)
+      datab.currentdata = parser.DataParser.read_shared(db_name, folder)
+      datab.setengine('cube')
+      return datab
+
+   def setengine(self,engine):
+       '''
+        Set the engine used by get_stats, one of GPDBuilder.engines.
+        With 'cube', requests with one which and at most one option are
+        computed on the DataCube of the db, the others on the pandas.
+       '''
+       if engine not in self.engines:
+           raise PyvoaError('engine must be one of ' + str(self.engines))
+       self.engine = engine
+
+   def getengine(self):
+       return self.engine
+
    def setgeo(self,geo):
        self.geo = geo
 
@@ -184,8 +275,8 @@ class GPDBuilder(object):
    def get_parserdb(self):
        return self.currentdata
 
-   def get_fulldb(self):
-      return self.currentdata.get_maingeopandas()
+   def get_fulldb(self, which = None):
+      return self.currentdata.get_maingeopandas(which)
 
    def get_available_GPDBuilder(self):
         '''
@@ -226,6 +317,50 @@ class GPDBuilder(object):
                 exploded=[tmp]
         return flat_list(exploded)
 
+   def wherestandard(self, where):
+        '''
+        Return the standard names of the locations of the list where,
+        regions being deployed in their locations
+        '''
+        if self.db_world:
+            return self.geo.to_standard(where,output='list',interpret_region=True)
+        return self.subregions_deployed(where,self.granularity)
+
+   def wherelocations(self, where, option):
+        '''
+        Return the standard names of all the locations of the where argument
+        of get_stats, as selected by whereclustered
+        '''
+        if 'sumall' not in option:
+            return self.wherestandard(flat_list(where))
+        names = []
+        for w in (where if isinstance(where[0],list) else [where]):
+            if not isinstance(w,list):
+                w = [w]
+            if self.db_world:
+                self.geo.set_standard('name')
+            names += self.wherestandard(w)
+        return names
+
+   @staticmethod
+   def wherefilter(input, where):
+        '''
+        Return the rows of input whose location is in the list where,
+        upper str comparision to be insensitive case.
+        With a categorical where column, the names are compared once per
+        category and rows are selected on the integer codes.
+        '''
+        upperwhere = [x.upper() for x in where]
+        if isinstance(input['where'].dtype, pd.CategoricalDtype):
+            categories = input['where'].cat.categories
+            selected = categories[categories.str.upper().isin(upperwhere)]
+            input = input.loc[input['where'].isin(selected)]
+            for c in ['where','code']:
+                if c in input.columns and isinstance(input[c].dtype, pd.CategoricalDtype):
+                    input[c] = input[c].cat.remove_unused_categories()
+            return input
+        return input.loc[input['where'].str.upper().isin(upperwhere)]
+
    def whereclustered(self,**kwargs):
         '''
         Handles the name and geometric behavior of the object
@@ -251,10 +386,8 @@ class GPDBuilder(object):
 
                 if self.db_world:
                     self.geo.set_standard('name')
-                    w_s = self.geo.to_standard(w,output='list',interpret_region=True)
-                else:
-                    w_s = self.subregions_deployed(w,self.granularity)
-                temp = input.loc[input['where'].str.upper().isin([x.upper() for x in w_s])].reset_index(drop=True)
+                w_s = self.wherestandard(w)
+                temp = self.wherefilter(input, w_s).reset_index(drop=True)
                 temp = gpd.GeoDataFrame(temp, geometry=temp.geometry, crs="EPSG:4326").reset_index(drop=True)
                 wherejoined  = ',' .join(flat_list(w))
                 code = temp.loc[temp.date==temp.date.max()]['code']
@@ -271,19 +404,30 @@ class GPDBuilder(object):
                     newpd = pd.concat([newpd,temp])
 
         else:
-            where = flat_list(where)
-            if self.db_world:
-                where = self.geo.to_standard(where,output='list',interpret_region=True)
-            else:
-                where = self.subregions_deployed(where,self.granularity)
-            newpd = input.loc[input['where'].str.upper().isin([x.upper() for x in where])]
+            where = self.wherestandard(flat_list(where))
+            newpd = self.wherefilter(input, where)
         newpd = gpd.GeoDataFrame(newpd, geometry=newpd.geometry, crs='EPSG:4326').reset_index(drop=True)
         where_geometry_none = newpd[newpd['geometry'].isna()]['where'].unique()
-        if where_geometry_none:
+        if len(where_geometry_none):
             PyvoaWarning('Those localisation have None geometry, remove them ...:'+str(where_geometry_none))
         newpd = newpd.dropna(subset=['geometry'])
         return newpd
 
+   @staticmethod
+   def whenclipped(when, when_beg_data, when_end_data):
+       '''
+        Return the dates (begin, end) of the when argument, limited to the
+        dates of the data
+       '''
+       when_beg, when_end = extract_dates(when)
+       if when_beg < when_beg_data:
+            when_beg = when_beg_data
+            PyvoaWarning("No available data before "+str(when_beg_data) + ' - ' + str(when_beg) + ' is considered')
+       if when_end > when_end_data:
+            when_end = when_end_data
+            PyvoaWarning("No available data after "+str(when_end_data) + ' - ' + str(when_end) + ' is considered')
+       return when_beg, when_end
+
    def get_stats(self,**kwargs):
        '''
             Return a fill kwargs after input arguments applied
@@ -303,44 +447,103 @@ class GPDBuilder(object):
        which = kwargs.get('which',[self.currentdata.get_available_keywords()[0]])
        if which == ['']:
           which = [self.currentdata.get_available_keywords()[0]]
-          kwargs['which'] = which
 
        kwargs_valuestesting(which,self.currentdata.get_available_keywords(),'which error ...')
-       when = kwargs.get('when')
+       kwargs['which'] = which
+
+       if not kwargs['input'].empty:
+           return self.compute_stats(**kwargs)
+       statscache = self.getstatscache()
+       key = self.get_stats_key(kwargs)
+       result = statscache.get(key)
+       if result is None:
+           result = self.compute_stats(**kwargs)
+           statscache.put(key, result)
+       else:
+           # where may be given in an other order than the cached request
+           result['where'] = copy.deepcopy(kwargs.get('where'))
+       return result
+
+   def get_stats_key(self, kwargs):
+       '''
+        Return the key of the get_stats request kwargs in the StatsCache (None
+        if the cache is not used): its arguments, where being normalized when
+        the result does not depend on its order nor on the spelling of the
+        names (sorted standard names, regions deployed), and the version of
+        the data of which (see DataParser.get_data_version), their datasets
+        being loaded first. Results of an older version are not hit anymore.
+       '''
+       statscache = self.getstatscache()
+       if not statscache.options['enabled']:
+           return None
+       version = self.currentdata.get_data_version(kwargs['which'])
+       key = {k:v for k,v in kwargs.items() if k != 'input'}
+       where = kwargs.get('where')
+       # sumall names the clusters with where, nonneg keeps its order
+       if where and 'sumall' not in kwargs['option'] and 'nonneg' not in kwargs['option']:
+           key['where'] = sorted(set(w.upper() for w in self.wherestandard(flat_list(where))))
+       return json.dumps([self.db, version, sorted(key.items())], default=str)
+
+   def getstatscache(self):
+       '''
+        Return the StatsCache of the results of get_stats
+       '''
+       if self.statscache is None:
+           self.statscache = StatsCache()
+       return self.statscache
+
+   def setstatscache(self, **kwargs):
+       '''
+        Set the options of the cache of the results of get_stats (see
+        StatsCache.set_options): enabled, max_bytes, folder (disk cache),
+        max_disk_bytes
+       '''
+       return self.getstatscache().set_options(**kwargs)
 
+   def compute_stats(self, **kwargs):
+       '''
+        get_stats for the arguments kwargs already tested, without the cache
+       '''
+       which = kwargs['which']
+       option = kwargs['option']
+       when = kwargs.get('when')
        input = kwargs['input']
 
+       if self.engine == 'cube' and input.empty and len(which) == 1 and len(option) <= 1:
+           cubekwargs = self.get_stats_cube(**kwargs)
+           if cubekwargs is not None:
+               return cubekwargs
+
+       # days between two dates of the data, 7 for weekly data kept at their own frequency
+       step = 1
        if input.empty:
-           input = self.currentdata.get_maingeopandas()
-           kwargs['input'] = input
+           input = self.currentdata.get_maingeopandas(which)
+           step = self.currentdata.get_step(which)
        anticolumns = [x for x in self.currentdata.get_available_keywords() if x not in which]
-
-       input = input.loc[:,~input.columns.isin(anticolumns)]
        where = kwargs.get('where')
 
-       kwargs['input'] = input
-       input['date'] = pd.to_datetime(input['date'], errors='coerce')
+       if not pd.api.types.is_datetime64_any_dtype(input['date']): # date is datetime64 in parsed data
+           input = input.assign(date = pd.to_datetime(input['date'], errors='coerce'))
        when_beg_data, when_end_data = input.date.min(), input.date.max()
        when_beg_data, when_end_data = when_beg_data.date(), when_end_data.date()
 
+       # filling, options and differences are done by location on the dates
+       # of when only: the rows of the other locations and dates are never copied
+       if where:
+           input = self.wherefilter(input, self.wherelocations(where, option))
        if when:
-           when_beg, when_end = extract_dates(when)
-           if when_beg < when_beg_data:
-                when_beg = when_beg_data
-                PyvoaWarning("No available data before "+str(when_beg_data) + ' - ' + str(when_beg) + ' is considered')
-           if when_end > when_end_data:
-                when_end = when_end_data
-                PyvoaWarning("No available data after "+str(when_end_data) + ' - ' + str(when_end) + ' is considered')
+           when_beg, when_end = self.whenclipped(when, when_beg_data, when_end_data)
            input = input[(input.date >= pd.to_datetime(when_beg)) & (input.date <= pd.to_datetime(when_end))]
-           kwargs['input'] = input
            when_beg_data,when_end_data = when_beg, when_end
+       input = input.loc[:,~input.columns.isin(anticolumns)]
+       kwargs['input'] = input
 
        kwargs['when'] = [str(when_beg_data)+':'+str(when_end_data)]
        flatwhere = flat_list(where)
        for w in which:
-           kwargs['input'].loc[:,w] = kwargs['input'].groupby('where')[w].bfill()
-           kwargs['input'].loc[:,w] = kwargs['input'].groupby('where')[w].ffill()
-           where_alldate_nan = kwargs['input'].groupby('where')[w].apply(lambda x: x.isna().all())
+           kwargs['input'].loc[:,w] = kwargs['input'].groupby('where',observed=True)[w].bfill()
+           kwargs['input'].loc[:,w] = kwargs['input'].groupby('where',observed=True)[w].ffill()
+           where_alldate_nan = kwargs['input'].groupby('where',observed=True)[w].apply(lambda x: x.isna().all())
            wherenan = where_alldate_nan[where_alldate_nan].index.tolist()
            if wherenan:
                PyvoaWarning('drop ' + str(wherenan) +' : value is NAN for all the date  ')
@@ -353,24 +556,21 @@ class GPDBuilder(object):
                if o == 'nonneg':
                    if w.startswith('cur_'):
                        raise PyvoaWarning('The option nonneg cannot be used with instantaneous data, such as : ' + w)
-                   concatpd = pd.DataFrame()
-                   for loca in flatwhere:
-                       pdwhere = temppd.loc[temppd['where'] == loca]
-                       nonneg = getnonnegfunc(pdwhere,w)
-                       if concatpd.empty:
-                           concatpd = nonneg
-                       else:
-                           concatpd = pd.concat([concatpd,nonneg])
-                   temppd = concatpd
+                   # row ordering only, as getnonnegfunc: the rows of each
+                   # location of where are taken at once, in its order
+                   rows = temppd.groupby('where',observed=True,sort=False).indices
+                   rows = [rows[loca] for loca in flatwhere if loca in rows]
+                   temppd = temppd.iloc[np.concatenate(rows) if rows else []]
                elif o == 'smooth7':
-                    temppd.loc[:,w] = temppd.groupby(['where'])[w].rolling(7,min_periods=7).mean().reset_index(level=0,drop=True)
-                    inx7 = temppd.groupby('where').head(7).index
+                    window = max(1, 7//step)
+                    temppd.loc[:,w] = temppd.groupby(['where'],observed=True)[w].rolling(window,min_periods=window).mean().reset_index(level=0,drop=True)
+                    inx7 = temppd.groupby('where',observed=True).head(window).index
                     temppd.loc[inx7, which] = temppd[w].bfill()
                elif o == 'sumall':
                     if w.startswith('cur_idx_') or w.startswith('cur_tx_'):
-                        temppd = temppd.groupby(['where','code','date','geometry']).mean().reset_index()
+                        temppd = temppd.groupby(['where','code','date','geometry'],observed=True).mean().reset_index()
                     else:
-                        temppd = temppd.groupby(['where','code','date','geometry']).sum(numeric_only=True).reset_index()
+                        temppd = temppd.groupby(['where','code','date','geometry'],observed=True).sum(numeric_only=True).reset_index()
                elif o.startswith('bypop='):
                      input = self.normbypop(input, which ,o)
                      kwargs['input'] = input
@@ -384,11 +584,19 @@ class GPDBuilder(object):
        input = kwargs['input']
        if not wconcatpd.empty:
            input = wconcatpd
-       input.loc[:,'daily'] = input.groupby('where')[w].diff()
-       input.loc[:,'weekly'] = input.groupby('where')[w].diff(7)
+       input.loc[:,'daily'] = input.groupby('where',observed=True)[w].diff()/step
+       input.loc[:,'weekly'] = input.groupby('where',observed=True)[w].diff(max(1, 7//step))
        input.loc[:,'daily'] = input['daily'].bfill()
        input.loc[:,'weekly'] = input['weekly'].bfill()
 
+       return self.stats_output(input, kwargs)
+
+   @staticmethod
+   def stats_output(input, kwargs):
+       '''
+        Set the output of get_stats in kwargs: input as a geopandas, sorted by
+        location (ordered by their last value of the first which) and date
+       '''
        input = input.reset_index(drop=True)
        if 'geometry' in input.columns:
           kwargs['input'] = gpd.GeoDataFrame(input, geometry=input.geometry, crs='EPSG:4326').reset_index(drop=True)
@@ -396,7 +604,7 @@ class GPDBuilder(object):
            kwargs['which'] = [kwargs['which']]
        where_ordered_bylastvalues = list(
             kwargs['input']
-            .groupby('where')
+            .groupby('where',observed=True)
             .tail(1)
             .sort_values(by=kwargs['which'][0], ascending=False)['where']
             .unique()
@@ -409,6 +617,126 @@ class GPDBuilder(object):
        kwargs['input'] = kwargs['input'].sort_values(by=['where','date'])
        return kwargs
 
+   def get_stats_cube(self,**kwargs):
+       '''
+            get_stats computed on the DataCube of the db (see pyvoa.datacube)
+            for one which and at most one option. Values are filled, smoothed,
+            summed and differenced along the date axis of the requested
+            locations only, the long pandas is built at the end.
+            Return None when the request is not handled here, get_stats then
+            works on the pandas.
+       '''
+       w = kwargs['which'][0]
+       option = kwargs['option']
+       o = option[0] if option else None
+       where = kwargs.get('where')
+       when = kwargs.get('when')
+       flatwhere = flat_list(where)
+       cube = self.currentdata.get_cube([w])
+       step = cube.step
+       lag = max(1, 7//step)
+
+       when_beg_data, when_end_data = cube.dates.min().date(), cube.dates.max().date()
+       when_beg, when_end = when_beg_data, when_end_data
+       if when:
+           when_beg, when_end = extract_dates(when)
+           when_beg, when_end = max(when_beg, when_beg_data), min(when_end, when_end_data)
+       i0, i1 = cube.get_date_slice(when_beg, when_end)
+       nd = i1 - i0
+       # first values of daily and weekly are taken in the same location
+       if nd <= lag:
+           return None
+
+       j = cube.keywords.index(w)
+       allnan = np.isnan(cube.values[:, i0:i1, j]).all(axis=1)
+       clusters = []
+       if o == 'sumall':
+           for c in (where if isinstance(where[0],list) else [where]):
+               if not isinstance(c,list):
+                   c = [c]
+               if self.db_world:
+                   self.geo.set_standard('name')
+               ids = cube.get_location_index(self.wherestandard(c))
+               ids = ids[~allnan[ids]]
+               if not len(ids):
+                   return None
+               clusters.append((','.join(flat_list(c)), ids))
+           if len(set(c[0] for c in clusters)) != len(clusters):
+               return None
+           ids = np.concatenate([c[1] for c in clusters])
+       else:
+           ids = cube.get_location_index(self.wherestandard(flatwhere))
+           if o is not None and o.startswith('bypop='):
+               if allnan[ids].any():
+                   return None
+           else:
+               ids = ids[~allnan[ids]]
+           if o == 'nonneg':
+               # nonneg keeps the locations given with their exact name, in this order
+               if len(set(flatwhere)) != len(flatwhere):
+                   return None
+               position = {name:i for i,name in enumerate(cube.locations['where'].values[ids])}
+               ids = np.array([ids[position[name]] for name in flatwhere if name in position], dtype=int)
+           if not len(ids):
+               return None
+       if cube.locations['geometry'].iloc[ids].isna().any():
+           return None
+
+       if when:
+           self.whenclipped(when, when_beg_data, when_end_data)
+           when_beg_data, when_end_data = when_beg, when_end
+       kwargs['when'] = [str(when_beg_data)+':'+str(when_end_data)]
+       if allnan.any():
+           wherenan = [i for i in cube.wherecategories if i in set(cube.locations['where'].values[allnan])]
+           PyvoaWarning('drop ' + str(wherenan) +' : value is NAN for all the date  ')
+
+       values = dc.ffill(dc.bfill(cube.get_values(w, ids, i0, i1)))
+       dates = cube.dates[i0:i1].values
+       locations = cube.locations.iloc[ids]
+       if o == 'nonneg' and w.startswith('cur_'):
+           raise PyvoaWarning('The option nonneg cannot be used with instantaneous data, such as : ' + w)
+       elif o == 'smooth7':
+           window = max(1, 7//step)
+           values = dc.rolling_mean(values, window)
+           values[:, :window] = values[:, window-1:window]
+
+       if o == 'sumall':
+           position = {id:i for i,id in enumerate(ids)}
+           values = np.array([values[[position[i] for i in c[1]]].sum(axis=0) for c in clusters])
+           geometry = [gpd.GeoSeries(cube.locations['geometry'].iloc[c[1]].values).unary_union for c in clusters]
+           input = pd.DataFrame({
+               'where': np.repeat([c[0] for c in clusters], nd),
+               'code': np.repeat([','.join(cube.locations['code'].iloc[c[1]]) for c in clusters], nd),
+               'date': np.tile(dates, len(clusters)),
+               'geometry': np.repeat(np.array(geometry, dtype=object), nd),
+               w: values.ravel(),
+               })
+       else:
+           codes = set(locations['code'])
+           input = pd.DataFrame({
+               'date': np.tile(dates, len(ids)),
+               'where': np.repeat(locations['where'].values, nd),
+               'code': pd.Categorical(np.repeat(locations['code'].values, nd),
+                   categories = [c for c in cube.codecategories if c in codes]),
+               w: values.ravel(),
+               'geometry': np.repeat(locations['geometry'].values, nd),
+               })
+           if o is not None and o.startswith('bypop='):
+               value = re.sub(r'^.*?bypop=', '', o)
+               pop_field, population = self.get_population(locations[['where','code','geometry']])
+               population = population.set_index('where')[pop_field].reindex(locations['where']).values
+               input[pop_field] = np.repeat(population, nd)
+               input[w+' '+o] = input[w]/input[pop_field]*GPDBuilder.dictbypop()[value]
+
+       daily = dc.diff(values)/step
+       daily[:, 0] = daily[:, 1]
+       weekly = dc.diff(values, lag)
+       weekly[:, :lag] = weekly[:, lag:lag+1]
+       input['daily'] = daily.ravel()
+       input['weekly'] = weekly.ravel()
+       kwargs['which'] = w
+       return self.stats_output(input, kwargs)
+
    def normbypop(self, pandy, val2norm ,bypop):
     """
         Return a pandas with a normalisation column add by population
@@ -417,10 +745,24 @@ class GPDBuilder(object):
     if pandy.empty:
         raise PyvoaError('normbypop problem, your pandas seems to be empty ....')
     value = re.sub(r'^.*?bypop=', '', bypop)
+    pop_field, uniquepandy = self.get_population(pandy)
+    pandy = pd.merge(pandy,uniquepandy,on='where',how='outer')
+
+    for i in val2norm:
+        pandy.loc[:,i+' '+bypop]=pandy[i]/pandy[pop_field]*GPDBuilder.dictbypop()[value]
+    return pandy
+
+   def get_population(self, pandy):
+    """
+        Return the name of the population field and a pandas with the
+        population of each location of pandy (where, population field)
+    """
     clust = list(pandy['where'].unique())
     pop_field='population'
-    uniquepandy = pandy.groupby('where').first().reset_index()
+    uniquepandy = pandy.groupby('where',observed=True).first().reset_index()
     if self.db_world == True:
+        if self._gi is None:
+            self._gi = coge.GeoInfo()
         uniquepandy = self._gi.add_field(input = uniquepandy,field = 'population')
     else:
         if not isinstance(self._gi,coge.GeoCountry):
@@ -441,11 +783,7 @@ class GPDBuilder(object):
         else:
             raise PyvoaKeyError('This is not region nor subregion what is it ?!')
     uniquepandy = uniquepandy[['where',pop_field]]
-    pandy = pd.merge(pandy,uniquepandy,on='where',how='outer')
-
-    for i in val2norm:
-        pandy.loc[:,i+' '+bypop]=pandy[i]/pandy[pop_field]*GPDBuilder.dictbypop()[value]
-    return pandy
+    return pop_field, uniquepandy
 
    def saveoutput(self,**kwargs):
        '''
@@ -470,7 +808,7 @@ class GPDBuilder(object):
        else:
           pandyori = kwargs['pandas']
        pandy = pandyori
-       pandy['date']=pandy['date'].apply(lambda x: x.strftime('%Y-%m-%d'))
+       pandy['date']=pd.to_datetime(pandy['date']).dt.strftime('%Y-%m-%d')
        if saveformat == 'excel':
            pandy.to_excel(savename+'.xlsx',index=False, na_rep='NAN')
        elif saveformat == 'csv':
@@ -18,8 +18,14 @@ import os.path
 from os import listdir
 from os.path import isfile, join
 import json
+import hashlib
 import datetime
+import time
 import collections
+import copy
+import pickle
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 import random
 import numpy as np
 from pyvoa.error import *
@@ -29,16 +35,41 @@ from pyvoa.tools import (
     kwargs_test,
     exists_from_url,
     get_local_from_url,
-    week_to_date,
+    open_local_file,
+    get_cache_folder,
+    get_content_sha256,
+    week_to_date_series,
     fill_missing_dates,
     flat_list
 )
 import pyvoa.geo as coge
+from pyvoa.datacube import DataCube
 import sys
 import pycountry
 import importlib.resources as pkg_resources
 from pathlib import Path
 import pyvoa
+from pyvoa.__version__ import __version__
+try:
+    import pyarrow
+    import pyarrow.csv
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# increased at each change of the data stored in the parsed data cache
+_parsed_cache_layout = 5
+
+# number of days between two dates of the data, by frequency of a dataset
+_frequency_steps = {'daily':1, 'weekly':7}
+
+# dtype of the columns which may be declared in the json description
+_column_dtypes = {
+    'float':'float64', 'float64':'float64',
+    'int':'int64', 'int64':'int64',
+    'str':'string', 'string':'string',
+    'date':'datetime64[s]',
+    }
 
 class MetaInfo:
   def __init__(self):
@@ -205,6 +236,18 @@ class MetaInfo:
       return [sig,msg]
 
 class DataParser:
+  # cached source files are considered as fresh during expiration_time seconds
+  expiration_time = 10000
+  # maximum number of sources downloaded at the same time
+  max_prefetch_workers = 8
+  # parsed data are stored as parquet files and reused while sources are unchanged
+  parsed_cache = True
+  # if set, sources are read by pieces of chunksize rows (default of the "chunksize" of datasets)
+  chunksize = None
+  # weekly datasets are kept at their own frequency, one row per week, if True (see
+  # get_steps_datasets), else spread on the daily dates as all the other ones (default)
+  native_frequency = False
+
   def __init__(self, namedb):
         self.db = namedb
         self.granu_country = False
@@ -225,7 +268,25 @@ class DataParser:
                 else:
                     PyvoaError('Granularity problem: neither country, region or subregion')
             # specific reading of data according to the db
-            self.mainpandas = self.get_parsing()
+            self.set_description()
+            self.localfiles = {}
+            # parsed datasets, by index in the json description, see load_keywords
+            self.datasets_db = {}
+            # parsed cache name of these datasets, see get_data_version
+            self.datasets_version = {}
+            # one pandas by step of dates of the data, see get_parsing
+            self.frames = {}
+            self.steps_datasets = {}
+            # standardized locations of the sources, see add_locations
+            self.rawlocations = pd.DataFrame(columns = ['where','code'])
+            self.geolocations = pd.DataFrame(columns = ['code','geometry'])
+            self.codenamedico = {}
+            self.mainpandas = None
+            # DataCube of the frames, built when needed, see get_cube
+            self.cubes = {}
+            # folder of the data when opened by read_shared, see write_shared
+            self.shared = None
+            self.load_keywords(self.get_available_keywords()[:1])
             self.get_echoinfo()
         except:
             raise PyvoaDbError("An error occured while parsing data of "+self.db+". This may be due to a data format modification. "
@@ -237,114 +298,419 @@ class DataParser:
       info('Example of where : ', random.choices(self.get_locations(), k=min(5,len(self.get_locations()))),' ...')
       info('Last date data ', pd.to_datetime(max(self.get_dates())).strftime("%m/%d/%Y"))
 
-  def get_parsing(self,):
+  def get_prefetch(self, urls = None):
       '''
-        Parse the json file load in the init fonction (self.metadata)
-        it returns a pandas with this structure
-        |date|where|code| var-1 ... var-n| geometry
-        var-i are the variable selected in the json file
-        To assure a good standardization "where" et "code" use geo metho
+        Download (or revalidate) at once the urls (default all the urldata of
+        the json description) on a bounded pool of threads, before any parsing.
+        Return a dictionnary url -> local filename.
+        Download time of each url is kept in self.prefetch_timing.
+        Fail as soon as one of the sources cannot be retrieved.
+      '''
+      if urls is None:
+          urls = [datasets['urldata'] for datasets in self.metadata['datasets']]
+      urls = list(dict.fromkeys(urls))
+      # append-only sources, only their new bytes are downloaded
+      incremental = [datasets['urldata'] for datasets in self.metadata['datasets'] if datasets.get('incremental',False)]
+      self.prefetch_timing = getattr(self, 'prefetch_timing', {})
+
+      def fetch(url):
+          t0 = time.time()
+          local = get_local_from_url(url,self.expiration_time,incremental=url in incremental)
+          return local, time.time() - t0
+
+      localfiles = {}
+      t0 = time.time()
+      executor = ThreadPoolExecutor(max_workers=max(1,min(len(urls),self.max_prefetch_workers)))
+      try:
+          futures = {executor.submit(fetch,url):url for url in urls}
+          done, notdone = wait(futures, return_when=FIRST_EXCEPTION)
+          for f in done:
+              if f.exception() is not None:
+                  for nd in notdone:
+                      nd.cancel()
+                  verb('Prefetch of '+futures[f]+' failed, stop here.')
+                  raise f.exception()
+          for f, url in futures.items():
+              localfiles[url], self.prefetch_timing[url] = f.result()
+              verb('Prefetch of '+url+' in %.2f s'%self.prefetch_timing[url])
+      finally:
+          executor.shutdown(wait=False)
+      verb('Prefetch of the %d source(s) of '%len(urls)+self.db+' in %.2f s'%(time.time()-t0))
+      return localfiles
+
+  def get_parsed_cache_filename(self, i):
+      '''
+        Return the base name (without extension) of the files of the parsed data
+        cache of the dataset i of the json description. It depends on a hash of
+        its json description, of the pyvoa version and of the content of its
+        source file.
+      '''
+      datasets = self.metadata['datasets'][i]
+      hasher = hashlib.sha256()
+      hasher.update((__version__ + ' %d'%_parsed_cache_layout).encode('utf-8'))
+      hasher.update(json.dumps({k:v for k,v in self.metadata.items() if k != 'datasets'}, sort_keys=True).encode('utf-8'))
+      hasher.update(json.dumps(datasets, sort_keys=True).encode('utf-8'))
+      url = datasets['urldata']
+      hasher.update((url + ' ' + get_content_sha256(self.localfiles[url])).encode('utf-8'))
+      folder = os.path.join(get_cache_folder(), 'parsed')
+      os.makedirs(folder, exist_ok=True)
+      return os.path.join(folder, self.db + '_%d_'%i + hasher.hexdigest()[:24])
+
+  def read_parsed_cache(self, i):
+      '''
+        Return the parsed dataset i (as parse_dataset) stored by
+        write_parsed_cache for the current source, or None if not available.
+      '''
+      if not self.parsed_cache or not PYARROW_AVAILABLE:
+          return None
+      t0 = time.time()
+      base = self.get_parsed_cache_filename(i)
+      try:
+          with open(base + '.json', 'r') as fp:
+              attributes = json.load(fp)
+          pandas_temp = pd.read_parquet(base + '.parquet')
+      except (OSError, ValueError):
+          return None
+      verb('Parsed data of ' + self.db + ' read from ' + base + '.parquet in %.2f s'%(time.time()-t0))
+      return attributes['step'], pandas_temp.set_index(['date','where'])
+
+  def write_parsed_cache(self, i, step, pandas_temp):
+      '''
+        Store the parsed dataset i (step and pandas given by parse_dataset) as
+        parquet and json files, see read_parsed_cache.
+        Previous versions for the same dataset are removed.
+      '''
+      if not self.parsed_cache or not PYARROW_AVAILABLE:
+          return
+      base = self.get_parsed_cache_filename(i)
+      try:
+          for f in os.listdir(os.path.dirname(base)):
+              if f.startswith(self.db + '_%d_'%i):
+                  os.remove(os.path.join(os.path.dirname(base), f))
+          # json last: it marks the cache as complete
+          pandas_temp.reset_index().to_parquet(base + '.parquet', index=False)
+          with open(base + '.json', 'w') as fp:
+              json.dump({'step':step}, fp)
+      except Exception as e:
+          verb('Cannot store parsed data of ' + self.db + ' : ' + str(e))
+
+  def read_csv_arrow(self, filename, separator, usecols, dtypes, dateformat=None, decimal='.'):
+      '''
+        Read the csv file filename with the multithreaded pyarrow reader.
+        dtypes gives the dtype of the columns (see _column_dtypes), the type
+        of the other columns is inferred. Date columns are parsed with
+        dateformat if given. Text columns are returned with the pandas
+        string dtype, never as object columns.
+        Used when dtypes are declared in the json description: comments
+        (lines starting with #) are not supported there.
+      '''
+      arrowtypes = {'float64':pyarrow.float64(), 'int64':pyarrow.int64(),
+          'string':pyarrow.string(), 'datetime64[s]':pyarrow.timestamp('s')}
+      timestamp_parsers = [pyarrow.csv.ISO8601]
+      if dateformat:
+          timestamp_parsers = [dateformat] + timestamp_parsers
+      convert_options = pyarrow.csv.ConvertOptions(
+          column_types = {k:arrowtypes[v] for k,v in dtypes.items()},
+          include_columns = usecols or [],
+          null_values = [''],
+          strings_can_be_null = True,
+          decimal_point = decimal,
+          timestamp_parsers = timestamp_parsers)
+      with open_local_file(filename) as fp:
+          table = pyarrow.csv.read_csv(fp,
+              read_options = pyarrow.csv.ReadOptions(use_threads = True),
+              parse_options = pyarrow.csv.ParseOptions(delimiter = separator),
+              convert_options = convert_options)
+      return table.to_pandas(types_mapper = {pyarrow.string():pd.StringDtype(),
+          pyarrow.large_string():pd.StringDtype()}.get)
+
+  def read_csv_chunks(self, filename, separator, usecols, dtype, chunksize, decimal='.', nrows=None):
+      '''
+        Read the csv file filename by pieces of chunksize rows, with the
+        options of the pandas reader of get_parsing. Yield one pandas per
+        piece: only one piece of the file is in memory at a time.
+      '''
+      try:
+          with open_local_file(filename) as fp:
+              with pd.read_csv(fp, sep = separator, usecols = usecols,
+                  keep_default_na = False, na_values = '' , header=0, dtype = dtype, decimal = decimal,
+                  nrows = nrows, comment='#', chunksize = chunksize) as reader:
+                  for chunk in reader:
+                      yield chunk
+      except PyvoaError:
+          raise
+      except Exception:
+          raise PyvoaError('Something went wrong during the parsing')
+
+  def apply_rules(self, pandas_temp, drop = None, selections = None, replace = None):
+      '''
+        Apply the rules of a dataset of the json description in one pass:
+        - drop: {column: prefix or list of prefixes}, rows with a missing value
+          or a value starting with one of the prefixes are removed
+        - selections: {column: value}, only rows with this value are kept, then
+          the column is removed
+        - replace: {old: new}, applied to the text columns only
+        The rules are compiled in a single boolean mask, so that the data are
+        filtered (copied) once. Cost and number of removed rows of each rule
+        are reported in verbose mode.
+      '''
+      rules = []
+      for key,val in (drop or {}).items():
+          if key in pandas_temp.columns:
+              prefixes = [val] if isinstance(val,str) else list(val)
+              if prefixes:
+                  rules.append(('drop '+key, key, prefixes))
+      for key,val in (selections or {}).items():
+          if key not in pandas_temp.columns:
+              raise PyvoaError("This is weird " + key + " selection went wrong ! ")
+          rules.append(('selection '+key, key, val))
+
+      mask = np.ones(len(pandas_temp), dtype = bool)
+      for name,key,val in rules:
+          t0 = time.time()
+          column = pandas_temp[key]
+          if name.startswith('drop'):
+              # prefixes tested once per distinct value, missing values have the code -1
+              codes, uniques = pd.factorize(column)
+              uniques = pd.Series(uniques, dtype = object)
+              dropped = np.zeros(len(uniques), dtype = bool)
+              for prefix in val:
+                  dropped |= uniques.str.startswith(prefix).fillna(False).to_numpy(dtype = bool)
+              keep = (codes != -1) & ~np.append(dropped, True)[codes]
+          else:
+              keep = (column == val).fillna(False).to_numpy(dtype = bool)
+          verb('Rule %s : %d rows removed in %.3f s'%(name, (mask & ~keep).sum(), time.time()-t0))
+          mask &= keep
+      if rules:
+          pandas_temp = pandas_temp.loc[mask].copy(deep = False) # a new frame, not a view
+      if selections:
+          pandas_temp = pandas_temp.drop(columns = list(selections.keys()))
+
+      if replace:
+          t0 = time.time()
+          text = [ c for c in pandas_temp.columns if pandas_temp[c].dtype == object or isinstance(pandas_temp[c].dtype, pd.StringDtype) ]
+          if text:
+              pandas_temp[text] = pandas_temp[text].replace(replace)
+          verb('Rule replace on %s in %.3f s'%(text, time.time()-t0))
+      return pandas_temp
+
+  def combine_datasets(self, datasets_db):
+      '''
+        Outer alignment at once of the datasets, each one indexed by unique
+        keys, such as (date, code). Return a pandas with the key columns and
+        the variables of all the datasets, sorted by the keys.
+        The values are written directly in the final table: no intermediate
+        merged tables.
+      '''
+      if len(datasets_db) == 1:
+          return datasets_db[0].reset_index()
+      names = list(datasets_db[0].index.names)
+      keys = pd.concat([d.index.to_frame(index = False) for d in datasets_db], ignore_index = True)
+      keys = keys.drop_duplicates().sort_values(names, ignore_index = True)
+      index = pd.MultiIndex.from_frame(keys)
+      columns = [ c for d in datasets_db for c in d.columns ]
+      values = np.full((len(index),len(columns)), np.nan)
+      j = 0
+      for d in datasets_db:
+          values[index.get_indexer(d.index), j:j+d.shape[1]] = d.to_numpy(dtype = float)
+          j += d.shape[1]
+      pandas_db = pd.DataFrame(values, columns = columns)
+      for name in reversed(names):
+          pandas_db.insert(0, name, keys[name])
+      return pandas_db
+
+  def set_description(self,):
+      '''
+        Set what is given by the json description alone, before any parsing:
+        description of the db, urls, available keywords with their definition
+        and url, and for each keyword the datasets providing it
       '''
       if 'header' in list(self.metadata.keys()):
           self.dbdescription = self.metadata['header']
       else:
           self.dbdescription = 'No description for DB = ' + self.db
-      pandas_db = pd.DataFrame()
-      locationmode = self.metadata['geoinfo']['locationmode']
-      granularity = self.metadata['geoinfo']['granularity']
-      place = self.metadata['geoinfo']['iso3']
-      debug = None
-      if 'debug' in list(self.metadata.keys()):
-          debug = self.metadata['debug']
-      replace_field = False
-      if 'replace' in list(self.metadata.keys()):
-          replace_field = self.metadata['replace']
-
       self.url = []
       self.keyword_definition = {}
       self.keyword_url = {}
-      for datasets in self.metadata['datasets']:
+      self.available_keywords = []
+      self.keyword_datasets = {}
+      for i, datasets in enumerate(self.metadata['datasets']):
           url = datasets['urldata']
+          self.url += [url]
           pdata = pd.DataFrame(datasets['columns'])
-          if 'alias' in list(pdata.columns):
-             # pdata.alias.fillna(pdata.name, inplace=True)
-              pdata["alias"] = pdata["alias"].fillna(pdata["name"])
-          else:
-              pdata['alias'] = pdata['name']
           if 'description' in list(pdata.columns):
                pdata['description'] = pdata['description'].fillna(value='No description')
           else:
               pdata['description'] = 'No description'
-          if 'cumulative' in list(pdata.columns):
-             pdata['cumulative'] = pdata['cumulative'].fillna(value=False)
-          else:
-            pdata['cumulative'] = False
-
-          usecols = pdata.alias.to_list()
-          selections = None
-          if 'selections' in list(datasets.keys()):
-              selections = datasets['selections']
-              usecols += list(selections.keys())
-          dropcolumns = None
-          if 'dropcolumns' in list(datasets.keys()):
-              dropcolumns = datasets['dropcolumns']
-              usecols = None
-          separator = ';'
-          if 'separator' in list(datasets.keys()):
-              separator = datasets['separator']
-          drop = {}
-          if 'drop' in list(datasets.keys()):
-              drop=datasets['drop']
-          cast = None
-          if 'cast' in list(datasets.keys()):
-               cast = datasets['cast']
-          decimal='.'
-          if 'decimal' in list(datasets.keys()):
-             decimal=datasets['decimal']
-          rename_columns = None
-          if 'alias' in list(pdata.columns) and 'name' in list(pdata.columns):
-            rename_columns = pdata.set_index('alias')['name'].to_dict()
-
           kd = pdata.loc[~pdata.name.isin(['where','date'])].set_index('name')['description'].to_dict()
           for k,v in kd.items():
               self.keyword_definition[k]=v
               self.keyword_url[k]=url
-          try:
-              pandas_temp = pd.read_csv(get_local_from_url(url,10000), sep = separator, usecols = usecols,
-                keep_default_na = False, na_values = '' , header=0, dtype = cast, decimal = decimal,
-                 low_memory = False, nrows = debug, comment='#')
-          except:
-              raise PyvoaError('Something went wrong during the parsing')
-
-          coltocumul = pdata.loc[pdata.cumulative]['alias'].to_list()
-          if coltocumul:
-            where_conditions = pdata.loc[pdata['name'] == 'where', 'alias']
-            if not where_conditions.empty:
-                wh = where_conditions.values[0]
-                pandas_temp[coltocumul] = pandas_temp.groupby(wh)[coltocumul].cumsum()
-            else:
-                pandas_temp[coltocumul] = pandas_temp[coltocumul].cumsum()
-
-          if drop and not debug:
-              for key,val in drop.items():
-                  if key in pandas_temp.columns:
-                      for i in val:
-                            pandas_temp = pandas_temp.dropna(subset=[key])
-                            pandas_temp = pandas_temp[~(pandas_temp[key].str.startswith(i))]
-                      #pandas_temp = pandas_temp.loc[~pandas_temp[key].isin(val)]
-
-          if selections:
-              for key,val in selections.items():
-                  if key in pandas_temp.columns:
-                      pandas_temp = pandas_temp.loc[pandas_temp[key] == val]
-                      pandas_temp = pandas_temp.drop(columns=key)
-                  else:
-                      raise PyvoaError("This is weird " + key + " selection went wrong ! ")
-          if replace_field:
-             for k,v in replace_field.items():
-                 if v =='np.nan':
-                    replace_field[k]=np.nan
-             pandas_temp = pandas_temp.replace(replace_field)
+          # columns in date format are melted in a single namedata keyword
+          keywords = [datasets.get('namedata')] if 'dropcolumns' in list(datasets.keys()) else list(kd.keys())
+          for k in keywords:
+              if k is None:
+                  continue
+              if k not in self.available_keywords:
+                  self.available_keywords.append(k)
+              self.keyword_datasets.setdefault(k, []).append(i)
+
+  def load_keywords(self, which = None):
+      '''
+        Parse the datasets providing the keywords which (default all of them)
+        which are not already parsed, then merge them in the data (see
+        get_parsing). Locations and dates are updated accordingly.
+        At init, only the dataset of the first keyword is parsed: the other
+        ones are downloaded and parsed when needed.
+      '''
+      if self.shared:
+          # all the keywords are stored by write_shared
+          return
+      if not which:
+          which = self.get_available_keywords()
+      todo = sorted(set(i for w in which for i in self.keyword_datasets.get(w,[]) if i not in self.datasets_db))
+      if not todo:
+          return
+      try:
+          self.localfiles.update(self.get_prefetch([self.metadata['datasets'][i]['urldata'] for i in todo]))
+          for i in todo:
+              parsed = self.read_parsed_cache(i)
+              if parsed is None:
+                  parsed = self.parse_dataset(self.metadata['datasets'][i])
+                  self.write_parsed_cache(i, *parsed)
+              self.datasets_db[i] = parsed
+              self.datasets_version[i] = os.path.basename(self.get_parsed_cache_filename(i))
+          self.frames = self.set_locations(*self.get_parsing(todo))
+          self.mainpandas = None
+          self.cubes = {}
+      except Exception as e:
+          raise PyvoaDbError("An error occured while parsing data of "+self.db+". This may be due to a data format modification. "
+              "You may contact support@pycoa.fr. Thanks.") from e
+
+  def parse_dataset(self, datasets):
+      '''
+        Parse one dataset of the json description (self.metadata): read its
+        source, apply its rules and reduce it on its (date, where) index.
+        Return the number of days between two dates of the dataset
+        (see _frequency_steps) and the reduced pandas.
+      '''
+      whereanddate =  ['date','where']
+      granularity = self.metadata['geoinfo']['granularity']
+      place = self.metadata['geoinfo']['iso3']
+      debug = None
+      if 'debug' in list(self.metadata.keys()):
+          debug = self.metadata['debug']
+      replace_field = False
+      if 'replace' in list(self.metadata.keys()):
+          replace_field = {k:(np.nan if v == 'np.nan' else v) for k,v in self.metadata['replace'].items()}
+
+      url = datasets['urldata']
+      pdata = pd.DataFrame(datasets['columns'])
+      if 'alias' in list(pdata.columns):
+         # pdata.alias.fillna(pdata.name, inplace=True)
+          pdata["alias"] = pdata["alias"].fillna(pdata["name"])
+      else:
+          pdata['alias'] = pdata['name']
+      if 'cumulative' in list(pdata.columns):
+         pdata['cumulative'] = pdata['cumulative'].fillna(value=False)
+      else:
+        pdata['cumulative'] = False
+
+      usecols = pdata.alias.to_list()
+      selections = None
+      if 'selections' in list(datasets.keys()):
+          selections = datasets['selections']
+          usecols += list(selections.keys())
+      dropcolumns = None
+      if 'dropcolumns' in list(datasets.keys()):
+          dropcolumns = datasets['dropcolumns']
+          usecols = None
+      separator = ';'
+      if 'separator' in list(datasets.keys()):
+          separator = datasets['separator']
+      drop = {}
+      if 'drop' in list(datasets.keys()):
+          drop=datasets['drop']
+      cast = None
+      if 'cast' in list(datasets.keys()):
+           cast = datasets['cast']
+      decimal='.'
+      if 'decimal' in list(datasets.keys()):
+         decimal=datasets['decimal']
+      rename_columns = None
+      if 'alias' in list(pdata.columns) and 'name' in list(pdata.columns):
+        rename_columns = pdata.set_index('alias')['name'].to_dict()
+
+      # dtypes declared in the description, by column of the csv file
+      dtypes = {}
+      if 'dtype' in list(pdata.columns):
+          dtypes = {k:_column_dtypes[v] for k,v in pdata.dropna(subset=['dtype']).set_index('alias')['dtype'].items()}
+      dateformat = None
+      if 'dateformat' in list(pdata.columns) and not pdata.loc[pdata.name == 'date','dateformat'].dropna().empty:
+          dateformat = pdata.loc[pdata.name == 'date','dateformat'].dropna().values[0]
+
+      isweek = usecols and ('semaine' in usecols or 'week' in usecols)
+      frequency = datasets.get('frequency', 'weekly' if isweek else 'daily')
+      if frequency not in _frequency_steps:
+          raise PyvoaError('frequency of ' + url + ' has to be one of ' + str(list(_frequency_steps.keys())))
+      coltocumul = pdata.loc[pdata.cumulative]['alias'].to_list()
+      where_conditions = pdata.loc[pdata['name'] == 'where', 'alias']
+      wh = where_conditions.values[0] if not where_conditions.empty else None
+      chunksize = datasets.get('chunksize', self.chunksize)
+      # the location and date keys are read as text (unless declared) by every
+      # reader: same type in every chunk, and whatever the reader used
+      keyaliases = pdata.loc[pdata.name.isin(whereanddate),'alias'].to_list()
+      try:
+          if chunksize:
+              dtype = dict(cast or {})
+              dtype.update({k:v for k,v in dtypes.items() if not v.startswith('datetime')})
+              for k in keyaliases:
+                  dtype.setdefault(k, 'str')
+              chunks = self.read_csv_chunks(self.localfiles[url], separator, usecols, dtype or None, chunksize, decimal, debug)
+          elif PYARROW_AVAILABLE and dtypes and not debug:
+              arrowdtypes = {k:_column_dtypes.get(v,v) for k,v in (cast or {}).items()}
+              arrowdtypes.update(dtypes)
+              for k in keyaliases:
+                  arrowdtypes.setdefault(k, 'string')
+              chunks = [self.read_csv_arrow(self.localfiles[url], separator, usecols, arrowdtypes, dateformat, decimal)]
+          else:
+              dtype = dict(cast or {})
+              dtype.update({k:v for k,v in dtypes.items() if not v.startswith('datetime')})
+              for k in keyaliases:
+                  dtype.setdefault(k, 'str')
+              with open_local_file(self.localfiles[url]) as fp:
+                  chunks = [pd.read_csv(fp, sep = separator, usecols = usecols,
+                    keep_default_na = False, na_values = '' , header=0, dtype = dtype, decimal = decimal,
+                     low_memory = False, nrows = debug, comment='#')]
+      except:
+          raise PyvoaError('Something went wrong during the parsing')
+
+      def cumulate(pandas_temp, cumul):
+          '''
+            Cumulative sum of the coltocumul columns (by location if any),
+            starting from the totals cumul of the previous chunks.
+            Return the sums and the totals to carry to the next chunk.
+          '''
+          if wh:
+              cumsum = pandas_temp.groupby(wh)[coltocumul].cumsum()
+              if cumul is not None:
+                  cumsum += cumul.reindex(pandas_temp[wh]).fillna(0).values
+              last = cumsum.groupby(pandas_temp[wh]).last()
+          else:
+              cumsum = pandas_temp[coltocumul].cumsum()
+              if cumul is not None:
+                  cumsum += cumul.fillna(0)
+              last = cumsum.ffill().iloc[-1] if len(cumsum) else cumsum.sum(min_count=1)
+          if cumul is not None:
+              last = last.combine_first(cumul)
+          return cumsum, last
+
+      def prepare(pandas_temp):
+          '''
+            Rules, renaming and date conversion of a chunk, reduced on its
+            (date, where) index
+          '''
+          pandas_temp = self.apply_rules(pandas_temp, drop if not debug else None, selections, replace_field)
 
           pandas_temp = pandas_temp.rename(columns = rename_columns)
           if dropcolumns:
@@ -356,9 +722,8 @@ class DataParser:
                   raise PyvoaError("Seems to have date in columns format in yours csv file, so namedata has to be defined in your json file")
               pandas_temp = pandas_temp.melt(id_vars='where',var_name='date',value_name=value_name)
 
-
-          if usecols and ('semaine' in usecols or 'week' in usecols):
-             pandas_temp['date'] = [ week_to_date(i) for i in pandas_temp['date']]
+          if isweek:
+             pandas_temp['date'] = week_to_date_series(pandas_temp['date'])
              #cols=[i for i in pandas_temp.columns if i not in ['date','where']]
              #pandas_temp[cols] = pandas_temp[cols].apply(lambda x: x/7.)
 
@@ -366,33 +731,63 @@ class DataParser:
           # elif self.db == "olympics":
           #     pandas_temp['date'] = pd.to_datetime(pandas_temp['date'], format='%Y', errors='coerce').dt.date
           # else:
-          pandas_temp['date'] = pd.to_datetime(pandas_temp['date'], errors='coerce').dt.date
+          pandas_temp['date'] = pd.to_datetime(pandas_temp['date'], format = dateformat, errors='coerce')
 
           if granularity == 'country' and 'where' not in list(pdata.name):
               pandas_temp['where'] = place
           pandas_temp['where'] = pandas_temp['where'].astype('string')
-          if pandas_db.empty:
-              pandas_db = pandas_temp
-          else:
-              pandas_db = pandas_db.merge(pandas_temp, how = 'outer', on=['where','date'])
-          self.url += [url]
-      whereanddate =  ['date','where']
-      notwhereanddate =  [ i  for i in list(pandas_db.columns) if i not in whereanddate ]
-      self.available_keywords = notwhereanddate
-      pandas_db[notwhereanddate] = pandas_db[notwhereanddate].astype(float)
-      pandas_db = pandas_db[whereanddate+notwhereanddate]
-      pandas_db = pandas_db.groupby(whereanddate).sum(min_count=1).reset_index()
-      pandas_db = fill_missing_dates(pandas_db)
-      pandas_db = pandas_db.sort_values(['where','date'])
-
-      self.available_keywords = list(pandas_db.columns)
-
-      if 'date' in self.available_keywords:
-          self.available_keywords.remove('date')
-      if 'where' in self.available_keywords:
-         self.available_keywords.remove('where')
-
-      locationdb = list(pandas_db['where'].unique())
+          notwhereanddate =  [ i  for i in list(pandas_temp.columns) if i not in whereanddate ]
+          tocast = [ i for i in notwhereanddate if pandas_temp[i].dtype != float ]
+          if tocast:
+              pandas_temp[tocast] = pandas_temp[tocast].astype(float)
+          return pandas_temp[whereanddate+notwhereanddate].groupby(whereanddate).sum(min_count=1)
+
+      # in streaming mode, partial tables are reduced together from time to time
+      cumul = None
+      parts = []
+      for pandas_temp in chunks:
+          if coltocumul:
+              pandas_temp[coltocumul], cumul = cumulate(pandas_temp, cumul)
+          parts.append(prepare(pandas_temp))
+          del pandas_temp
+          if len(parts) >= 16:
+              parts = [pd.concat(parts).groupby(level = whereanddate).sum(min_count=1)]
+      del chunks
+      pandas_temp = parts[0] if len(parts) == 1 else pd.concat(parts).groupby(level = whereanddate).sum(min_count=1)
+      return _frequency_steps[frequency], pandas_temp
+
+
+
+  def get_steps_datasets(self,):
+      '''
+        Return the parsed datasets (indices of self.datasets_db) by step of
+        dates of the frame storing them. All of them are stored with the daily
+        ones unless native_frequency is set: a weekly dataset is then stored
+        as it is if its dates are on a 7 days grid and if its variables are
+        not also given at an other frequency.
+      '''
+      steps_datasets = {}
+      for i in sorted(self.datasets_db):
+          step = self.datasets_db[i][0] if self.native_frequency else 1
+          steps_datasets.setdefault(step, []).append(i)
+      for step in [s for s in steps_datasets if s != 1]:
+          dbs = [self.datasets_db[i][1] for i in steps_datasets[step]]
+          dates = pd.Index(pd.concat([d.index.get_level_values('date').to_series() for d in dbs]).unique())
+          others = [c for s,members in steps_datasets.items() if s != step for i in members for c in self.datasets_db[i][1].columns]
+          offgrid = ((dates - dates.min()).days % step != 0).any()
+          if offgrid or any(c in others for d in dbs for c in d.columns):
+              verb('Weekly data of ' + self.db + ' stored as daily data.')
+              steps_datasets.setdefault(1, []).extend(steps_datasets.pop(step))
+      return {step:sorted(members) for step,members in steps_datasets.items()}
+
+  def add_locations(self, locationdb):
+      '''
+        Standardize the locations locationdb, as found in the sources, with
+        the geo methods. Their name and code are added to self.rawlocations
+        (indexed by the location of the sources) and the geometry of their
+        code to self.geolocations
+      '''
+      locationmode = self.metadata['geoinfo']['locationmode']
       granularity = self.metadata['geoinfo']['granularity']
       codenamedico = {}
       geopd = pd.DataFrame()
@@ -417,27 +812,186 @@ class DataParser:
           geopd = geopd.rename(columns={"code_subregion": "code"})
       elif granularity == 'region':
           geopd = self.geo.get_region_list()
-          codenamedico = self.geo.get_data().set_index('code_region')['name_region'].to_dict()
           #geopd['name_region'] = geopd['name_region'].str.title()
           codenamedico = geopd.set_index('code_region')['name_region'].to_dict()
           geopd = geopd.rename(columns={"code_region": "code"})
       else:
           raise PyvoaTypeError('Not a region nors ubregion ... sorry but what is it ?')
+      self.codenamedico.update(codenamedico)
 
+      pandas_db = pd.DataFrame({'where':locationdb}, index = locationdb)
       if locationmode == "code":
           pandas_db = pandas_db.rename(columns={"where": "code"})
           pandas_db['code'] = pandas_db['code'].str.upper()
-          pandas_db['where'] = pandas_db['code'].map(codenamedico)
+          pandas_db['where'] = pandas_db['code'].map(self.codenamedico)
       elif locationmode == "name":
           pandas_db['where'] = pandas_db['where'].str.title()
-          reverse={v:k for k,v in codenamedico.items()}
+          reverse={v:k for k,v in self.codenamedico.items()}
           pandas_db['code'] = pandas_db['where'].map(reverse)
       else:
           PyvoaError("what locationmode in your json file is supposed to be ?")
-      self.slocation = list(pandas_db['where'].unique())
-      self.dates = list(pandas_db['date'].unique())
-      pandas_db = pandas_db.merge(geopd[['code','geometry']], how = 'inner', on='code')
-      return pandas_db
+      self.rawlocations = pd.concat([self.rawlocations, pandas_db[['where','code']]])
+      geolocations = pd.concat([self.geolocations, pd.DataFrame(geopd[['code','geometry']])])
+      self.geolocations = geolocations.drop_duplicates('code').reset_index(drop = True)
+
+  def get_standardized(self, pandas_temp):
+      '''
+        Return the parsed dataset pandas_temp (see parse_dataset) indexed by
+        (date, code) of its locations, standardized with add_locations.
+        Locations unknown from the geo methods are dropped.
+      '''
+      pandas_temp = pandas_temp.reset_index()
+      locationdb = pd.Index(pandas_temp['where'].unique()).difference(self.rawlocations.index)
+      if len(locationdb):
+          self.add_locations(list(locationdb))
+      pandas_temp['code'] = pandas_temp['where'].map(self.rawlocations['code']).astype(object)
+      pandas_temp = pandas_temp.loc[pandas_temp['code'].isin(self.geolocations['code'])].drop(columns = 'where')
+      pandas_temp = pandas_temp.set_index(['date','code'])
+      if not pandas_temp.index.is_unique: # several names of the same location in the source
+          pandas_temp = pandas_temp.groupby(level = ['date','code']).sum(min_count=1)
+      return pandas_temp
+
+  def get_parsing(self, new):
+      '''
+        Merge the newly parsed datasets new (indices of self.datasets_db, see
+        parse_dataset) in the data, one pandas by step of dates
+        (see get_steps_datasets) with this structure
+        |date|where|code| var-1 ... var-n| geometry
+        Only the new datasets are merged into the current pandas of their
+        step, which is rebuilt only if some of its datasets moved to an other
+        step. To assure a good standardization "where" et "code" use geo
+        metho, see add_locations.
+        Return the frames and the list of the steps whose pandas changed.
+      '''
+      whereanddate =  ['date','where']
+      steps_datasets = self.get_steps_datasets()
+      frames = {step:pandas_db for step,pandas_db in self.frames.items() if step in steps_datasets}
+      changed = []
+      for step, members in sorted(steps_datasets.items()):
+          old = self.steps_datasets.get(step, [])
+          if members == old and step in frames:
+              continue
+          dbs = []
+          if step in frames and set(old) <= set(members):
+              current = frames[step]
+              dbs.append(current.drop(columns = ['where','geometry']).assign(code = current['code'].astype(str)).set_index(['date','code']))
+              members = [i for i in members if i not in old]
+          dbs += [self.get_standardized(self.datasets_db[i][1]) for i in members]
+          pandas_db = self.combine_datasets(dbs)
+          frames[step] = fill_missing_dates(pandas_db, loc_field = 'code', freq = '%dD'%step)
+          changed.append(step)
+      self.steps_datasets = steps_datasets
+
+      self.keyword_frequency = {c:step for step,pandas_db in frames.items() for c in pandas_db.columns if c not in whereanddate+['code','geometry']}
+      self.slocation = list(self.rawlocations.sort_index()['where'].unique())
+      alldates = pd.concat([pandas_db['date'] for pandas_db in frames.values()])
+      if len(frames) == 1:
+          self.dates = alldates.drop_duplicates().sort_values().tolist()
+      else:
+          self.dates = pd.date_range(alldates.min(), alldates.max()).tolist()
+      return frames, changed
+
+  def set_locations(self, frames, changed):
+      '''
+        Build the location dimension table self.locations (code, where and
+        geometry, one row per location) and return the frames (one pandas by
+        step of dates, see get_parsing) with where and code as categoricals.
+        Where and geometry are added to the frames of the steps changed.
+        When names and codes are one to one, the integer codes of both
+        categoricals are the rows of the dimension table.
+      '''
+      locations = self.rawlocations.loc[self.rawlocations['code'].isin(self.geolocations['code'])]
+      locations = locations.drop_duplicates('code').merge(self.geolocations, how = 'inner', on = 'code')
+      locations = locations[['code','where','geometry']].sort_values('code').reset_index(drop=True)
+      onetoone = locations['where'].notna().all() and locations['where'].is_unique
+      wherecategories = locations['where'].tolist() if onetoone else sorted(locations['where'].dropna().unique())
+      bycode = locations.set_index('code')
+      for step in changed:
+          pandas_db = frames[step]
+          pandas_db.insert(1, 'where', bycode['where'].reindex(pandas_db['code']).values)
+          pandas_db['geometry'] = bycode['geometry'].reindex(pandas_db['code']).values
+          frames[step] = pandas_db.sort_values(['where','date']).reset_index(drop = True)
+      for pandas_db in frames.values():
+          pandas_db['code'] = pd.Categorical(pandas_db['code'], categories = locations['code'].tolist())
+          pandas_db['where'] = pd.Categorical(pandas_db['where'], categories = wherecategories)
+      self.locations = locations
+      return frames
+
+  @staticmethod
+  def get_shared_folder(namedb):
+      '''
+        Return the default folder of the shared data of the db namedb,
+        see write_shared
+      '''
+      return os.path.join(get_cache_folder(), 'shared', namedb)
+
+  def write_shared(self, folder = None):
+      '''
+        Write all the data of the db in folder (default get_shared_folder) so
+        that other processes open them with read_shared without parsing nor
+        copying them: one DataCube by step of dates (see DataCube.save) and
+        the parser itself without its data.
+        Each writing is a new version of the folder, the file current pointing
+        to it is changed last. Older versions are removed, except the previous
+        one which may still be opened.
+        Return the folder of the version written.
+      '''
+      folder = folder or self.get_shared_folder(self.db)
+      self.load_keywords()
+      version = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+      path = os.path.join(folder, version)
+      for step in sorted(set(self.keyword_frequency.values())):
+          cube = self.get_cube([w for w,s in self.keyword_frequency.items() if s == step])
+          cube.save(os.path.join(path, 'cube_%d'%step))
+      parser = copy.copy(self)
+      parser.localfiles, parser.datasets_db, parser.frames, parser.cubes = {}, {}, {}, {}
+      parser.mainpandas, parser.locations, parser.shared = None, None, None
+      parser.geolocations = parser.geolocations.iloc[:0]
+      with open(os.path.join(path, 'parser.pkl'), 'wb') as f:
+          pickle.dump(parser, f)
+      tmp = os.path.join(folder, 'current.%d'%os.getpid())
+      with open(tmp, 'w') as fp:
+          json.dump({'version':version, 'pyvoa_version':__version__}, fp)
+      os.replace(tmp, os.path.join(folder, 'current'))
+      versions = sorted(d for d in listdir(folder) if os.path.isdir(os.path.join(folder, d)))
+      for d in versions[:-2]:
+          shutil.rmtree(os.path.join(folder, d), ignore_errors = True)
+      info('Shared data of ' + self.db + ' written in ' + path)
+      return path
+
+  @staticmethod
+  def read_shared(namedb, folder = None):
+      '''
+        Return the DataParser of the db namedb written by write_shared in
+        folder (default get_shared_folder). Its values are read-only memory
+        maps of the files: they are loaded once in the page cache of the OS
+        for all the processes reading them.
+      '''
+      folder = folder or DataParser.get_shared_folder(namedb)
+      try:
+          with open(os.path.join(folder, 'current'), 'r') as fp:
+              current = json.load(fp)
+      except (OSError, ValueError):
+          raise PyvoaError('No shared data of ' + namedb + ' in ' + folder + ', see write_shared.')
+      if current['pyvoa_version'] != __version__:
+          raise PyvoaError('Shared data of ' + namedb + ' written by pyvoa ' + current['pyvoa_version'] +
+              ', they must be written again.')
+      path = os.path.join(folder, current['version'])
+      with open(os.path.join(path, 'parser.pkl'), 'rb') as f:
+          parser = pickle.load(f)
+      parser.shared = path
+      parser.cubes = {step:DataCube.open(os.path.join(path, 'cube_%d'%step))
+                      for step in sorted(set(parser.keyword_frequency.values()))}
+      locations = pd.concat([cube.locations[['code','where','geometry']] for cube in parser.cubes.values()])
+      parser.locations = locations.drop_duplicates('code').sort_values('code').reset_index(drop=True)
+      return parser
+
+  def get_location_table(self,):
+      '''
+        Return the location dimension table: code, where and geometry of each
+        location, the categories of the code and where columns of the data
+      '''
+      return self.locations
 
   def get_db(self,):
      '''
@@ -453,12 +1007,12 @@ class DataParser:
 
   def get_locations(self,):
       ''' Return available location countries / regions / subregions in the current database
-          Using the geo method standardization
+          Using the geo method standardization (for the datasets parsed so far)
       '''
       return self.slocation
 
   def get_dates(self,):
-      ''' Return all dates available in the current database as datetime format'''
+      ''' Return all dates available in the current database as datetime format (for the datasets parsed so far)'''
       return self.dates
 
   def get_available_keywords(self):
@@ -494,12 +1048,98 @@ class DataParser:
       '''
       return self.dbdescription
 
-  def get_maingeopandas(self,):
+  def get_step(self, which = None):
+      '''
+        Return the number of days between two dates of the data of the
+        variables which (default all the variables): 7 for weekly data.
+        Variables of different frequencies are aligned on days, step is then 1.
+      '''
+      if not which:
+          which = self.get_available_keywords()
+      self.load_keywords(which)
+      steps = set(self.keyword_frequency[w] for w in which if w in self.keyword_frequency)
+      if len(steps) == 1:
+          return steps.pop()
+      return 1
+
+  def get_data_version(self, which = None):
+      '''
+        Return a hash of the data of the variables which (default all), their
+        datasets being parsed if not already done. It changes with the content
+        of the sources of these datasets, their json description, the pyvoa
+        version and the range of dates of the data, not with the other
+        datasets loaded.
+      '''
+      if not which:
+          which = self.get_available_keywords()
+      self.load_keywords(which)
+      datasets = sorted(set(i for w in which for i in self.keyword_datasets.get(w,[])))
+      # the values of which are given on all the dates of the data
+      dates = [str(min(self.dates)), str(max(self.dates))] if self.dates else []
+      hasher = hashlib.sha256()
+      hasher.update((self.db + json.dumps([[i, self.datasets_version.get(i)] for i in datasets] + dates)).encode('utf-8'))
+      return hasher.hexdigest()[:24]
+
+  def get_maingeopandas(self, which = None):
       '''
       return the parsing of the data + the geometry description as a geopandas
+      Data are given at their own frequency (see get_step) when all the variables
+      which (default all) have the same one, else aligned on days.
+      Datasets of these variables are parsed if not already done.
       '''
-      col = list(self.mainpandas.columns)
-      reorder = ['date','where','code']
-      reorder += [ i for i in col if i not in reorder ]
-      self.mainpandas = self.mainpandas[reorder]
+      if not which:
+          which = self.get_available_keywords()
+      self.load_keywords(which)
+      steps = set(self.keyword_frequency[w] for w in which if w in self.keyword_frequency)
+      if len(steps) == 1:
+          return self.get_frame(steps.pop())
+      if self.mainpandas is None:
+          self.mainpandas = self.get_aligned()
       return self.mainpandas
+
+  def get_frame(self, step):
+      '''
+        Return the pandas of the data of step days between two dates.
+        For shared data (see read_shared) it is built from the cube when needed.
+      '''
+      if step not in self.frames:
+          self.frames[step] = self.cubes[step].to_frame()
+      return self.frames[step]
+
+  def get_cube(self, which = None):
+      '''
+        Return the data of the variables which (default all) as a DataCube
+        (see pyvoa.datacube), built once from the pandas given by
+        get_maingeopandas(which)
+      '''
+      if not which:
+          which = self.get_available_keywords()
+      self.load_keywords(which)
+      steps = set(self.keyword_frequency[w] for w in which if w in self.keyword_frequency)
+      key = steps.pop() if len(steps) == 1 else 0
+      if key not in self.cubes:
+          pandas_db = self.get_maingeopandas(which)
+          keywords = [c for c in pandas_db.columns if c not in ['date','where','code','geometry']]
+          self.cubes[key] = DataCube.from_frame(pandas_db, keywords, key or 1)
+      return self.cubes[key]
+
+  def get_aligned(self,):
+      '''
+        Return the data of all the frequencies in one pandas, aligned on days:
+        values of weekly variables are given on their own date, other days
+        are empty
+      '''
+      dates = pd.date_range(min(self.dates), max(self.dates), name = 'date')
+      full = pd.MultiIndex.from_product([self.locations['code'], dates], names = ['code','date'])
+      frames = {step:self.get_frame(step) for step in sorted(set(self.keyword_frequency.values()))}
+      aligned = [ pandas_db.assign(code = pandas_db['code'].astype(str)).set_index(['code','date'])
+                  .drop(columns = ['where','geometry']).reindex(full) for pandas_db in frames.values() ]
+      pandas_db = pd.concat(aligned, axis = 1).reset_index()
+      locations = self.locations.set_index('code')
+      pandas_db.insert(1, 'where', locations['where'].reindex(pandas_db['code']).values)
+      pandas_db['geometry'] = locations['geometry'].reindex(pandas_db['code']).values
+      wherecategories = frames[min(frames)]['where'].cat.categories
+      pandas_db['code'] = pd.Categorical(pandas_db['code'], categories = self.locations['code'].tolist())
+      pandas_db['where'] = pd.Categorical(pandas_db['where'], categories = wherecategories)
+      pandas_db = pandas_db[['date','where','code'] + [w for w in self.get_available_keywords() if w in self.keyword_frequency] + ['geometry']]
+      return pandas_db.sort_values(['where','date']).reset_index(drop = True)
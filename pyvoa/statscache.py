@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Project : PyvoA
+Date :    april 2020 - march 2025
+Authors : Olivier Dadoun, Julien Browaeys, Tristan Beau
+Copyright ©pyvoa_fr
+License: See joint LICENSE file
+https://pyvoa.org/
+
+Module : pyvoa.statscache
+
+About :
+-------
+
+Cache of the results of GPDBuilder.get_stats.
+
+Results are stored by key (the normalized arguments of the request and the
+version of the data, see GPDBuilder.get_stats_key). The least recently used
+ones are kept in memory within a budget in bytes, and, if a folder is given,
+they are also written on disk so that other processes (or a next session) on
+the same data get them without any computation. A result larger than the
+memory budget is not cached, on disk neither: it would be copied and pickled
+at each request while it could never be kept in memory. The key includes the
+version of the data: results of an older version are never hit again and
+are evicted as the least recently used ones.
+
+Basic usage
+-----------
+    import pyvoa.statscache as sc
+    cache = sc.StatsCache(max_bytes = 64*1024**2, folder = '/tmp/stats')
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+    cache.get_stats()
+"""
+
+import os
+import copy
+import pickle
+import hashlib
+import threading
+import collections
+import pandas as pd
+
+from pyvoa.tools import (
+    verb,
+    kwargs_keystesting,
+)
+
+class StatsCache:
+    '''
+        Results of get_stats by key, see the module description.
+        Options (see set_options):
+        - enabled: use the cache (default True)
+        - max_bytes: memory budget (default 128 MB)
+        - folder: folder of the disk cache, None for no disk cache (default)
+        - max_disk_bytes: disk budget (default 1 GB)
+    '''
+    def __init__(self, **kwargs):
+        self.options = {'enabled':True, 'max_bytes':128*1024**2, 'folder':None, 'max_disk_bytes':1024**3}
+        self.lock = threading.Lock()
+        self.clear()
+        self.set_options(**kwargs)
+
+    def __getstate__(self):
+        # results and lock are not pickled with the GPDBuilder
+        return {'options':self.options}
+
+    def __setstate__(self, state):
+        self.__init__(**state['options'])
+
+    def set_options(self, **kwargs):
+        '''
+            Set the options of the cache, return them
+        '''
+        kwargs_keystesting(kwargs, list(self.options.keys()), 'Bad args used in the StatsCache.set_options() function.')
+        with self.lock:
+            self.options.update(kwargs)
+            self.evict()
+        return dict(self.options)
+
+    def clear(self):
+        '''
+            Drop the results in memory and reset the counters
+        '''
+        with self.lock:
+            self.entries = collections.OrderedDict()
+            self.bytes = 0
+            self.stats = {'hits':0, 'disk_hits':0, 'misses':0, 'evictions':0}
+
+    @staticmethod
+    def copy(result):
+        '''
+            Return a copy of a result of get_stats: the caller may change it
+        '''
+        return {k:v.copy() if isinstance(v, pd.DataFrame) else copy.deepcopy(v) for k,v in result.items()}
+
+    @staticmethod
+    def sizeof(result):
+        '''
+            Size in bytes of a result of get_stats, its pandas only
+        '''
+        return int(sum(v.memory_usage(deep=True, index=True).sum() for v in result.values() if isinstance(v, pd.DataFrame)))
+
+    def get_filename(self, key):
+        '''
+            File of the result of key in the disk cache
+        '''
+        return os.path.join(self.options['folder'], hashlib.sha256(key.encode('utf-8')).hexdigest() + '.pkl')
+
+    def get(self, key):
+        '''
+            Return a copy of the result stored for key, None if not available
+        '''
+        if key is None or not self.options['enabled']:
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.copy(self.entries[key][1])
+        if self.options['folder']:
+            filename = self.get_filename(key)
+            try:
+                with open(filename, 'rb') as f:
+                    result = pickle.load(f)
+                os.utime(filename)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                result = None
+            if result is not None:
+                with self.lock:
+                    self.stats['disk_hits'] += 1
+                self.store(key, result)
+                return self.copy(result)
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, result):
+        '''
+            Store a copy of result for key, in memory and on disk if a folder is set.
+            A result larger than the memory budget is not stored at all, neither
+            in memory nor on disk: it is neither copied nor pickled.
+        '''
+        if key is None or not self.options['enabled']:
+            return
+        nbytes = self.sizeof(result)
+        if self.options['max_bytes'] is not None and nbytes > self.options['max_bytes']:
+            verb('Result of get_stats of %d bytes larger than the cache budget, not stored'%nbytes)
+            return
+        result = self.copy(result)
+        self.store(key, result, nbytes)
+        if self.options['folder']:
+            filename = self.get_filename(key)
+            try:
+                os.makedirs(self.options['folder'], exist_ok=True)
+                with open(filename + '.%d'%os.getpid(), 'wb') as f:
+                    pickle.dump(result, f)
+                os.replace(filename + '.%d'%os.getpid(), filename)
+                self.evict_disk()
+            except OSError as e:
+                verb('Cannot store the result of get_stats in ' + self.options['folder'] + ' : ' + str(e))
+
+    def store(self, key, result, nbytes = None):
+        '''
+            Store result (of nbytes bytes, see sizeof) in memory as the most recently used one
+        '''
+        if nbytes is None:
+            nbytes = self.sizeof(result)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[0]
+            if self.options['max_bytes'] is not None and nbytes > self.options['max_bytes']:
+                return
+            self.entries[key] = (nbytes, result)
+            self.bytes += nbytes
+            self.evict()
+
+    def evict(self):
+        '''
+            Drop the least recently used results until the memory budget is respected,
+            the lock must be held
+        '''
+        max_bytes = self.options['max_bytes']
+        while self.entries and max_bytes is not None and self.bytes > max_bytes:
+            nbytes, _ = self.entries.popitem(last=False)[1]
+            self.bytes -= nbytes
+            self.stats['evictions'] += 1
+
+    def evict_disk(self):
+        '''
+            Remove the least recently used files of the disk cache until the disk budget is respected
+        '''
+        max_bytes = self.options['max_disk_bytes']
+        if max_bytes is None:
+            return
+        files = [(f.stat().st_mtime, f.stat().st_size, f.path) for f in os.scandir(self.options['folder'])
+                 if f.is_file() and f.name.endswith('.pkl')]
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def get_stats(self):
+        '''
+            Return a dictionnary of statistics on the cache: hits (in memory),
+            disk hits, misses, hit rate, evictions, number of results and
+            bytes in memory, memory budget
+        '''
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes_used'] = self.bytes
+        total = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits'])/total if total else 0.
+        stats['max_bytes'] = self.options['max_bytes']
+        return stats
@@ -29,8 +29,17 @@ import numpy
 import datetime
 import time
 import os.path
+import json
+import hashlib
+import gzip
+import zlib
+import itertools
 import requests
-from tempfile import gettempdir
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+from contextlib import contextmanager
+from tempfile import gettempdir, mkstemp
 from getpass import getuser
 from zlib import crc32
 from urllib.parse import urlparse
@@ -47,9 +56,46 @@ _coacache_module_info = importlib.util.find_spec("coacache")
 if _coacache_module_info != None:
     _coacache_folder = _coacache_module_info.submodule_search_locations[0]
 
+# folders of imported offline bundles, see set_offline_folders and pyvoa.bundle
+_offline_folders = []
+_offline_only = False
+# urls requested while recording, see record_urls
+_url_records = None
+
 # Verbosity of pycoa
 _verbose_mode = 1 # default
 
+# adding headers for server which does not accept no browser presentation
+_http_headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+# size of the chunks used to stream downloaded data to disk
+_download_chunk_size = 1024*1024
+_incremental_tail_size = 64*1024 # last bytes checked before an incremental download
+
+# HTTP session shared by all the network accesses of pyvoa, see set_http_options
+_http_options = {
+    'pool_size':10,          # number of kept alive connections per host
+    'max_per_host':4,        # number of simultaneous requests to the same host
+    'retries':3,             # number of retries on connection errors or 5xx answers
+    'backoff_factor':0.5,    # exponential backoff: 0.5s, 1s, 2s ... between retries
+    'timeout':(10,120),      # (connect, read) timeouts in seconds
+    }
+_http_session = None
+_http_host_semaphores = {}
+_http_lock = threading.Lock()
+
+# local cache of downloaded data, see set_cache_options and get_cache_stats
+_cache_options = {
+    'max_bytes':int(os.environ.get('PYVOA_CACHE_MAX_BYTES',4*1024**3)), # disk budget
+    'min_age':3600,  # entries used within the last hour are never evicted
+    'compress':True, # text contents are stored gzip compressed
+    'lock_timeout':600, # a download lock not refreshed for this time (in s) is stale
+    'lock_poll':0.2,    # time (in s) between two tries to get a download lock
+    }
+_cache_objects_folder = 'objects'  # contents stored by sha256, cached files are links to them
+_compressed_suffix = '.gz' # added to the name of the cached files stored compressed
+_cache_stats = {'hits':0,'misses':0,'bytes_downloaded':0,'bytes_saved':0,'bytes_deduplicated':0}
+_cache_lock = threading.Lock()
+
 # ----------------------------------------------------
 # --- Usefull functions for pycoa.--------------------
 # ----------------------------------------------------
@@ -175,8 +221,9 @@ def tostdstring(s):
     """
     return unidecode.unidecode(' '.join(s.replace('-',' ').split())).upper()
 
-def fill_missing_dates(p, date_field='date', loc_field='where', d1=None, d2=None):
-    """Filling the input pandas dataframe p with missing dates
+def fill_missing_dates(p, date_field='date', loc_field='where', d1=None, d2=None, freq='D'):
+    """Filling the input pandas dataframe p with missing dates, one every freq
+    (default every day, '7D' for weekly data) starting from d1
     """
     if not isinstance(p, pd.DataFrame):
         raise PyvoaTypeError("Expecting input p as a pandas dataframe.")
@@ -193,26 +240,18 @@ def fill_missing_dates(p, date_field='date', loc_field='where', d1=None, d2=None
         d1=p[date_field].min()
 
     if not all(isinstance(d, datetime.date) for d in [d1,d2]):
-        raise PyvoaTypeError("Waiting for dates as datetime.date.")
+        raise PyvoaTypeError("Waiting for dates as datetime.date or datetime64.")
     if d1 > d2:
         raise PyvoaKeyError("Dates should be ordered as d1<d2.")
 
-    idx = pd.date_range(d1, d2, freq = "D")
-    idx = idx.date
-    all_loc=list(p[loc_field].unique())
-
-    pfill=pd.DataFrame()
-    for l in all_loc:
-        pp=p.loc[p[loc_field]==l]
-        pp2=pp.set_index([date_field])
-        pp2.index = pd.DatetimeIndex(pp2.index)
-        pp3 = pp2.reindex(idx,fill_value=pd.NA)#numpy.nan)#
-        pp3[loc_field] = pp3[loc_field].fillna(l)  #pp3['location'].fillna(method='bfill')
-        #pp3['isowhere'] = pp3['isowhere'].fillna(method='bfill')
-        #pp3['isowhere'] = pp3['isowhere'].fillna(method='ffill')
-        pfill=pd.concat([pfill, pp3])
-    pfill.reset_index(inplace=True)
-    return pfill
+    idx = pd.date_range(d1, d2, freq = freq, name = date_field)
+    all_loc = p[loc_field].unique()
+
+    # one reindex on the (location, date) product, locations in order of appearance
+    full = pd.MultiIndex.from_product([all_loc, idx], names = [loc_field, date_field])
+    pfill = p.set_index([loc_field, date_field]).reindex(full, fill_value = pd.NA).reset_index()
+    pfill[loc_field] = pfill[loc_field].astype(p[loc_field].dtype)
+    return pfill[[date_field] + [c for c in p.columns if c != date_field]]
 
 def check_valid_date(date):
     """Check if a string is compatible with a valid date under the format day/month/year
@@ -302,14 +341,526 @@ def week_to_date(whenstr):
         convertion = datetime.datetime.strptime(whenstr  + '-1' , "%G-S%V-%u")+datetime.timedelta(days = 7)
     return convertion
 
+def week_to_date_series(whens):
+    """
+    Vectorized version of week_to_date() for a pandas Series (or a list) of
+    strings. Each distinct string is converted once, and the result broadcast.
+    Same layouts: rolling week Y-M-D-Y-M-D, Y-M-D and week number YYYYww or
+    YYYY-Sww. Other strings go through week_to_date() itself.
+    Return a pandas Series of datetime64 with the index of whens.
+    """
+    whens = pd.Series(whens)
+    codes, uniques = pd.factorize(whens)
+    u = pd.Series(uniques, dtype=object).astype(str)
+    n = u.str.len()
+    converted = pd.Series(pd.NaT, index=u.index, dtype='datetime64[ns]')
+
+    def ymd(parts):
+        return pd.to_datetime(pd.DataFrame({'year':parts[0].astype(int),'month':parts[1].astype(int),'day':parts[2].astype(int)}))
+
+    rolling = u.loc[n == 21].str.split('-', expand=True)
+    if not rolling.empty:
+        firstday = ymd([rolling[0],rolling[1],rolling[2]])
+        lastday = ymd([rolling[3],rolling[4],rolling[5]])
+        # date + timedelta drops the half day of odd ranges
+        converted.loc[rolling.index] = firstday + pd.to_timedelta((lastday-firstday).dt.days//2, unit='D')
+    oneday = u.loc[n == 10].str.split('-', expand=True)
+    if not oneday.empty:
+        converted.loc[oneday.index] = ymd([oneday[0],oneday[1],oneday[2]]) + pd.Timedelta(days=3)
+    others = u.loc[(n != 21) & (n != 10)]
+    weeks = others.str.extract(r'^(\d{4})-S(\d{1,2})$')
+    weeks.loc[others.str.len() == 6] = others.loc[others.str.len() == 6].str.extract(r'^(\d{4})(\d{2})$').values
+    weeks = weeks.dropna().astype(int)
+    weeks = weeks.loc[(weeks[1] >= 1) & (weeks[1] <= 53)]
+    if not weeks.empty:
+        # monday of the ISO week 1 is the monday of the week of january the 4th
+        jan4 = pd.to_datetime(weeks[0]*10000+104, format='%Y%m%d')
+        week1 = jan4 - pd.to_timedelta(jan4.dt.weekday, unit='D')
+        converted.loc[weeks.index] = week1 + pd.to_timedelta(7*weeks[1], unit='D')
+    for i in others.index.difference(weeks.index):
+        converted.loc[i] = week_to_date(u.loc[i])
+    values = converted.to_numpy()[codes]
+    values[codes == -1] = np.datetime64('NaT')
+    return pd.Series(values, index=whens.index)
+
+def set_http_options(**kwargs):
+    """Set the options of the HTTP session shared by all the downloads of pyvoa.
+
+    Keyword arguments
+    -----------------
+    pool_size      -- number of connections kept alive per host
+    max_per_host   -- maximal number of simultaneous requests to the same host
+    retries        -- number of retries on connection errors, resets or 5xx answers
+    backoff_factor -- the n-th retry is delayed by backoff_factor*2**(n-1) seconds
+    timeout        -- (connect, read) timeouts in seconds
+
+    The shared session is rebuilt at next request. Return the current options.
+    """
+    global _http_session
+    kwargs_keystesting(kwargs,list(_http_options.keys()),'Bad args used in the set_http_options() function.')
+    with _http_lock:
+        _http_options.update(kwargs)
+        if _http_session is not None:
+            _http_session.close()
+        _http_session = None
+        _http_host_semaphores.clear()
+    return dict(_http_options)
+
+def get_http_session():
+    """Return the process-wide requests session used by pyvoa.
+
+    Connections are pooled and kept alive so that repeated downloads from the
+    same host reuse them. Idempotent requests are retried with an exponential
+    backoff on connection errors and 5xx answers.
+    """
+    global _http_session
+    with _http_lock:
+        if _http_session is None:
+            retry = Retry(total=_http_options['retries'],
+                backoff_factor=_http_options['backoff_factor'],
+                status_forcelist=(500,502,503,504),
+                allowed_methods=frozenset(['HEAD','GET']),
+                raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=_http_options['pool_size'],
+                pool_maxsize=_http_options['pool_size'],max_retries=retry)
+            session = requests.Session()
+            session.headers.update(_http_headers)
+            session.mount('http://',adapter)
+            session.mount('https://',adapter)
+            _http_session = session
+        return _http_session
+
+def _get_host_semaphore(url):
+    """Return the semaphore limiting the simultaneous requests to the host of url
+    """
+    host = urlparse(url).netloc
+    with _http_lock:
+        if host not in _http_host_semaphores:
+            _http_host_semaphores[host] = threading.BoundedSemaphore(_http_options['max_per_host'])
+        return _http_host_semaphores[host]
+
+@contextmanager
+def http_get(url,**kwargs):
+    """Context manager doing a GET request of url through the shared session.
+    Extra kwargs are given to requests. The number of simultaneous requests to
+    a given host is limited (see set_http_options).
+    """
+    kwargs.setdefault('timeout',_http_options['timeout'])
+    with _get_host_semaphore(url):
+        with get_http_session().get(url,allow_redirects=True,**kwargs) as r:
+            yield r
+
 def exists_from_url(path):
     """"Check if url for files responds
     Boolean return
     """
-    r = requests.head(path)
+    with _get_host_semaphore(path):
+        r = get_http_session().head(path,timeout=_http_options['timeout'])
     return r.status_code == requests.codes.ok
 
-def get_local_from_url(url,expiration_time=0,suffix=''):
+def get_cache_folder():
+    """Return the folder where downloaded data are locally cached
+    """
+    tmpdir=os.path.join(gettempdir(),"pycoa.data"+"_"+getuser())
+    os.makedirs(os.path.join(tmpdir,_cache_objects_folder),exist_ok=True)
+    return tmpdir
+
+def _get_sidecar_filename(local_filename):
+    """Return the name of the metadata file stored alongside a locally cached file
+    """
+    return local_filename+'.meta'
+
+def _read_sidecar(local_filename):
+    """Return the metadata (ETag, Last-Modified, ...) stored alongside a locally
+    cached file as a dict. An empty dict is returned if there is none.
+    """
+    try:
+        with open(_get_sidecar_filename(local_filename),'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+def _write_sidecar(local_filename,meta):
+    """Store the metadata dict alongside the locally cached file
+    """
+    try:
+        _atomic_write(_get_sidecar_filename(local_filename),[json.dumps(meta).encode('utf-8')])
+    except OSError:
+        verb('Cannot write metadata for '+local_filename)
+
+def _atomic_write(filename,chunks):
+    """Write the iterable of bytes chunks into filename.
+
+    Data are first written in a temporary file of the same directory, synced
+    to disk and then renamed, so that a reader either sees the previous
+    version of the file or the complete new one, never a partial file.
+    Return the number of written bytes.
+    """
+    fd,tmp_filename=mkstemp(dir=os.path.dirname(filename),prefix='.'+os.path.basename(filename),suffix='.part')
+    size=0
+    try:
+        with os.fdopen(fd,'wb') as fp:
+            for chunk in chunks:
+                if chunk:
+                    fp.write(chunk)
+                    size+=len(chunk)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp_filename,0o644) # mkstemp creates a file readable only by its owner
+        os.replace(tmp_filename,filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    return size
+
+def _store_in_cache(local_filename,chunks,prefix_filename=None):
+    """Store the iterable of bytes chunks as the cached file local_filename.
+
+    The content is stored once in the objects folder of the cache, under the
+    name of the sha256 hash of the content (see _get_object_name), and the
+    cached file is a hard link to it. Thus identical contents downloaded from different urls are stored
+    only once. Text contents (csv, html, json ...) are stored gzip compressed
+    as local_filename+'.gz', see open_local_file().
+    If prefix_filename is given, the chunks are appended to its content (as a
+    new gzip member if it is compressed).
+    Return the name of the cached file, the sha256 hex digest and the size of
+    the content, whether it is stored compressed and the sha256 hex digest of
+    its last bytes (see _incremental_tail_size).
+    """
+    objects_folder=os.path.join(os.path.dirname(local_filename),_cache_objects_folder)
+    hasher=hashlib.sha256()
+    raw_size=[0]
+    tail=bytearray()
+
+    def account(chunk):
+        hasher.update(chunk)
+        raw_size[0]+=len(chunk)
+        tail.extend(chunk)
+        del tail[:-_incremental_tail_size]
+
+    def raw_chunks(chunks):
+        for chunk in chunks:
+            account(chunk)
+            yield chunk
+
+    def stored_prefix():
+        with open(prefix_filename,'rb') as fp:
+            for chunk in iter(lambda: fp.read(_download_chunk_size),b''):
+                yield chunk
+
+    if prefix_filename:
+        compress=is_compressed_file(prefix_filename)
+        with open_local_file(prefix_filename) as fp:
+            for chunk in iter(lambda: fp.read(_download_chunk_size),b''):
+                account(chunk)
+        stored_chunks=raw_chunks(chunks)
+        if compress:
+            stored_chunks=_gzip_chunks(stored_chunks) # concatenated gzip members are a valid gzip file
+        stored_chunks=itertools.chain(stored_prefix(),stored_chunks)
+    else:
+        chunks=iter(chunks)
+        first=next(chunks,b'')
+        compress=_cache_options['compress'] and b'\0' not in first[:8192] # only text is worth it
+        stored_chunks=raw_chunks(itertools.chain([first],chunks))
+        if compress:
+            stored_chunks=_gzip_chunks(stored_chunks)
+    tmp_object=os.path.join(objects_folder,'new_'+os.path.basename(local_filename))
+    _atomic_write(tmp_object,stored_chunks)
+    sha=hasher.hexdigest()
+    size=raw_size[0]
+    object_filename=os.path.join(objects_folder,_get_object_name(sha,compress))
+    if os.path.exists(object_filename):
+        os.remove(tmp_object)
+        os.utime(object_filename) # protect it from a concurrent prune_cache
+        _count_cache_stats(bytes_deduplicated=size)
+        verb('Content of '+local_filename+' already cached, deduplicated.')
+    else:
+        os.replace(tmp_object,object_filename)
+    stored_filename=local_filename+_compressed_suffix if compress else local_filename
+    tmp_link=local_filename+'.link'
+    try:
+        if os.path.exists(tmp_link):
+            os.remove(tmp_link)
+        os.link(object_filename,tmp_link)
+        os.replace(tmp_link,stored_filename)
+    except OSError: # hard links are not supported, then copy the content
+        with open(object_filename,'rb') as fp:
+            _atomic_write(stored_filename,iter(lambda: fp.read(_download_chunk_size),b''))
+    # the other storage of the same url is outdated
+    other_filename=local_filename if compress else local_filename+_compressed_suffix
+    for f in [other_filename,_get_sidecar_filename(other_filename)]:
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+    return stored_filename,sha,size,compress,hashlib.sha256(tail).hexdigest()
+
+def _get_object_name(sha,compressed):
+    """Return the name in the objects folder of the content of sha256 hex
+    digest sha. A content is stored once per encoding: the gzip compressed
+    one has the suffix of compressed cached files.
+    """
+    return sha+_compressed_suffix if compressed else sha
+
+def _gzip_chunks(chunks):
+    """Gzip compress on the fly the iterable of bytes chunks
+    """
+    z=zlib.compressobj(6,zlib.DEFLATED,31) # 31 : gzip header and trailer
+    for chunk in chunks:
+        c=z.compress(chunk)
+        if c:
+            yield c
+    yield z.flush()
+
+def is_compressed_file(filename):
+    """Return True if the local file is gzip compressed
+    """
+    with open(filename,'rb') as fp:
+        return fp.read(2)==b'\x1f\x8b'
+
+def _find_local_file(local_filename,migrate=False):
+    """Return the name of the file storing local_filename, which is
+    local_filename+'.gz' if it is stored compressed, or local_filename if it
+    does not exist (yet) at all.
+    If migrate is True, a compressed content stored without the .gz suffix (as
+    done by previous versions of the cache) is renamed with its metadata.
+    """
+    compressed_filename=local_filename+_compressed_suffix
+    if os.path.exists(compressed_filename):
+        return compressed_filename
+    if migrate and os.path.exists(local_filename) and is_compressed_file(local_filename):
+        try:
+            os.replace(local_filename,compressed_filename)
+            if os.path.exists(_get_sidecar_filename(local_filename)):
+                os.replace(_get_sidecar_filename(local_filename),_get_sidecar_filename(compressed_filename))
+            return compressed_filename
+        except OSError:
+            pass
+    return local_filename
+
+def open_local_file(filename,mode='rb',encoding=None):
+    """Open for reading a file returned by get_local_from_url.
+    Data stored compressed in the cache are transparently decompressed on the
+    fly. Mode is 'rb' (default) or 'r' for text.
+    """
+    if mode not in ['r','rb']:
+        raise PyvoaError('open_local_file only opens files for reading, with mode r or rb.')
+    if is_compressed_file(filename):
+        return gzip.open(filename,'rt' if mode=='r' else 'rb',encoding=encoding)
+    return open(filename,mode,encoding=encoding)
+
+def get_gdal_path(filename):
+    """Return the path of a file returned by get_local_from_url to be used by
+    geopandas (gdal) readers. Compressed data are read through the gdal
+    /vsigzip/ virtual file system, without decompression on disk.
+    """
+    if is_compressed_file(filename):
+        return '/vsigzip/'+filename
+    return filename
+
+def get_content_sha256(filename):
+    """Return the sha256 hex digest of the content of a file returned by
+    get_local_from_url, as stored in its metadata or computed if unknown
+    (offline files for instance).
+    """
+    sha=_read_sidecar(filename).get('sha256')
+    if sha:
+        return sha
+    hasher=hashlib.sha256()
+    with open_local_file(filename) as fp:
+        for chunk in iter(lambda: fp.read(_download_chunk_size),b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _count_cache_stats(**kwargs):
+    """Increment the cache statistics counters given as kwargs
+    """
+    with _cache_lock:
+        for k,v in kwargs.items():
+            _cache_stats[k]+=v
+
+def _get_saved_size(local_filename,meta=None):
+    """Return the size of the content of a cached file, as transferred when
+    downloaded (and not its size on disk, which is smaller if compressed)
+    """
+    if meta is None:
+        meta=_read_sidecar(local_filename)
+    if meta.get('size') is not None:
+        return meta['size']
+    return os.path.getsize(local_filename) # not downloaded by pyvoa, e.g. coacache
+
+def _touch_cache_entry(local_filename,meta=None):
+    """Record the access time of a cache entry, used for the LRU eviction
+    """
+    if meta is None:
+        meta=_read_sidecar(local_filename)
+    if meta:
+        meta['last_access']=time.time()
+        _write_sidecar(local_filename,meta)
+
+def set_cache_options(**kwargs):
+    """Set the options of the local cache of downloaded data.
+
+    Keyword arguments
+    -----------------
+    max_bytes -- disk budget of the cache in bytes. When exceeded, least recently
+                 used entries are evicted. None means no limit.
+    min_age   -- entries used within the last min_age seconds are never evicted.
+    compress  -- store newly downloaded text contents gzip compressed (boolean).
+
+    Return the current options.
+    """
+    kwargs_keystesting(kwargs,list(_cache_options.keys()),'Bad args used in the set_cache_options() function.')
+    _cache_options.update(kwargs)
+    return dict(_cache_options)
+
+def get_cache_entries():
+    """Return a pandas dataframe describing the entries of the local cache:
+    url, local filename, sha256 of the content, name of the stored object
+    (see _get_object_name), size (in bytes), age and time since last access
+    (in seconds).
+    """
+    tmpdir=get_cache_folder()
+    now=time.time()
+    entries=[]
+    for f in os.scandir(tmpdir):
+        if not f.is_file() or f.name.startswith('.') or f.name.endswith(('.meta','.link','.lock')):
+            continue
+        meta=_read_sidecar(f.path)
+        st=f.stat()
+        entries.append({'url':meta.get('url'),
+            'filename':f.path,
+            'sha256':meta.get('sha256'),
+            'object':_get_object_name(meta['sha256'],f.name.endswith(_compressed_suffix)) if meta.get('sha256') else None,
+            'size':st.st_size,
+            'age':now-meta.get('created',st.st_mtime),
+            'last_access':now-meta.get('last_access',st.st_mtime),
+            })
+    col=['url','filename','sha256','object','size','age','last_access']
+    return pd.DataFrame(entries,columns=col).sort_values(by='last_access').reset_index(drop=True)
+
+def _get_cache_usage(tmpdir):
+    """Return the disk usage (in bytes) of the cache, hard links counted once
+    """
+    inodes={}
+    for folder in [tmpdir,os.path.join(tmpdir,_cache_objects_folder)]:
+        for f in os.scandir(folder):
+            if f.is_file():
+                st=f.stat()
+                inodes[(st.st_dev,st.st_ino)]=st.st_size
+    return sum(inodes.values())
+
+def get_cache_stats():
+    """Return a dictionnary of statistics on the local cache of downloaded data:
+    hits (data used without any transfer, including 304 answers), misses
+    (downloads), hit rate, bytes downloaded, bytes saved (not transferred thanks
+    to the cache), bytes deduplicated, number of entries, disk usage and budget.
+    Counters are those of the current process.
+    """
+    tmpdir=get_cache_folder()
+    with _cache_lock:
+        stats=dict(_cache_stats)
+    total=stats['hits']+stats['misses']
+    stats['hit_rate']=stats['hits']/total if total else 0.
+    stats['entries']=len(get_cache_entries())
+    stats['bytes_used']=_get_cache_usage(tmpdir)
+    stats['max_bytes']=_cache_options['max_bytes']
+    return stats
+
+def prune_cache(max_bytes=None,max_age=None):
+    """Evict entries of the local cache of downloaded data.
+
+    Entries not accessed for more than max_age seconds are removed. Then the
+    least recently used entries are removed until the disk usage is below
+    max_bytes (default is the max_bytes option, see set_cache_options()).
+    Entries used within the last min_age seconds (see set_cache_options())
+    are kept. Contents which are not referenced anymore are removed.
+    Return the number of removed entries and of freed bytes as a dict.
+    """
+    tmpdir=get_cache_folder()
+    if max_bytes is None:
+        max_bytes=_cache_options['max_bytes']
+    now=time.time()
+    usage_before=_get_cache_usage(tmpdir)
+    entries=get_cache_entries()
+    evictable=entries.loc[entries.last_access>_cache_options['min_age']]
+    removed=0
+
+    def remove(filename):
+        for f in [filename,_get_sidecar_filename(filename)]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    usage=usage_before
+    for e in evictable.sort_values(by='last_access',ascending=False).itertuples():
+        if not ((max_age is not None and e.last_access>max_age) or (max_bytes is not None and usage>max_bytes)):
+            continue
+        remove(e.filename)
+        removed+=1
+        entries=entries.loc[entries.filename!=e.filename]
+        if e.object is None: # file not stored as a content of the cache
+            usage-=e.size
+        elif e.object not in entries.object.values:
+            remove(os.path.join(tmpdir,_cache_objects_folder,e.object))
+            usage-=e.size
+    # contents not referenced anymore, or temporary files of crashed downloads
+    referenced=set(entries.object.dropna())
+    for f in os.scandir(os.path.join(tmpdir,_cache_objects_folder)):
+        if f.name not in referenced and now-f.stat().st_mtime>_cache_options['min_age']:
+            remove(f.path)
+    for f in os.scandir(tmpdir):
+        if f.name.startswith('.') and f.name.endswith('.part') and now-f.stat().st_mtime>_cache_options['min_age']:
+            remove(f.path)
+        elif f.name.endswith('.lock') and now-f.stat().st_mtime>_cache_options['lock_timeout']:
+            remove(f.path)
+    freed=usage_before-_get_cache_usage(tmpdir)
+    if removed:
+        verb('Cache pruned: %d entries removed, %d bytes freed'%(removed,freed))
+    return {'removed':removed,'freed':freed}
+
+def set_offline_folders(folders,offline_only=True):
+    """Set the list of folders (e.g. imported bundles, see pyvoa.bundle) where
+    get_local_from_url first looks for the data of an url. Those files are
+    always used as they are. If offline_only is True, no network access is
+    done at all and an url missing from the folders raises an error.
+    Return the current list of folders.
+    """
+    global _offline_folders, _offline_only
+    if not isinstance(folders,list):
+        folders=[folders]
+    _offline_folders=[f for f in folders if f]
+    _offline_only=bool(offline_only) and _offline_folders!=[]
+    return _offline_folders
+
+def get_offline_folders():
+    """Return the list of folders set by set_offline_folders
+    """
+    return _offline_folders
+
+@contextmanager
+def record_urls():
+    """Context manager recording all the urls requested to get_local_from_url
+    within the block. It yields a dictionnary url -> (local filename, suffix).
+    """
+    global _url_records
+    previous=_url_records
+    _url_records={}
+    try:
+        yield _url_records
+    finally:
+        if previous is not None:
+            previous.update(_url_records)
+        _url_records=previous
+
+def get_local_base_filename(url,suffix=''):
+    """Return the name (without folder) of the local file caching the url
+    """
+    return urlparse(url).netloc+"_"+str(crc32(bytes(url,'utf-8')))+suffix
+
+def get_local_from_url(url,expiration_time=0,suffix='',incremental=False):
     """"Download data from the given url and store it into a local file.
 
     If the expiration time is 0 (default), the data will never be downloaded anymore if available.
@@ -317,20 +868,111 @@ def get_local_from_url(url,expiration_time=0,suffix=''):
     If the expiration time (in seconds) is lower than time difference between now and last modification
     time of the file, the file is downloaded.
 
+    When a locally stored version exists, the ETag and Last-Modified values returned
+    by the server are sent back (If-None-Match / If-Modified-Since). If the server
+    answers 304 Not Modified, the local file is kept and only its modification time
+    is refreshed.
+
+    Downloaded contents are stored once per content hash, and the cache is kept
+    below its disk budget (see set_cache_options(), get_cache_stats(), prune_cache()).
+    Text contents are stored gzip compressed and the returned filename then ends
+    with .gz, so that readers inferring the compression from the name (pandas,
+    gdal) read it as is. open_local_file() and get_gdal_path() read any of them.
+
+    Files of the offline folders (see set_offline_folders) are used first.
+
+    If incremental is True, the source is expected to be only appended: the size
+    and the last bytes of the locally stored version are checked with a Range
+    request, and only the new bytes are downloaded. A full download is done if
+    the server does not support ranges or if the beginning of the content changed.
+
     One may add a suffix to the local filename if known.
     """
+    local_filename=_get_local_from_url(url,expiration_time,suffix,incremental)
+    if _url_records is not None:
+        with _cache_lock:
+            _url_records[url]=(local_filename,suffix)
+    return local_filename
 
-    tmpdir=os.path.join(gettempdir(),"pycoa.data"+"_"+getuser())
-    if not os.path.exists(tmpdir):
-        os.makedirs(tmpdir)
+@contextmanager
+def _download_lock(local_filename):
+    """Cross-process lock on the download of local_filename.
+
+    The lock is the file local_filename+'.lock', created exclusively. Other
+    processes (or threads) wait for its removal. A lock which has not been
+    refreshed (see _refresh_lock) for more than the lock_timeout option is
+    considered as left by a crashed process and is broken.
+    Yield the name of the lock file.
+    """
+    lock_filename=local_filename+'.lock'
+    waiting=False
+    while True:
+        try:
+            fd=os.open(lock_filename,os.O_CREAT|os.O_EXCL|os.O_WRONLY,0o644)
+            break
+        except FileExistsError:
+            try:
+                age=time.time()-os.path.getmtime(lock_filename)
+            except OSError: # just released
+                continue
+            if age>_cache_options['lock_timeout']:
+                verb('Breaking stale download lock '+lock_filename)
+                try:
+                    os.remove(lock_filename)
+                except OSError:
+                    pass
+                continue
+            if not waiting:
+                verb('Waiting for another process downloading '+local_filename)
+                waiting=True
+            time.sleep(_cache_options['lock_poll'])
+    try:
+        os.write(fd,str(os.getpid()).encode()) # for debugging purpose
+        os.close(fd)
+        yield lock_filename
+    finally:
+        try:
+            os.remove(lock_filename)
+        except OSError:
+            pass
+
+def _refresh_lock(lock_filename,chunks,period=10):
+    """Yield the chunks, refreshing the mtime of the lock at most every period
+    seconds so that a long download is not taken for a crashed one.
+    """
+    last=time.time()
+    for chunk in chunks:
+        if time.time()-last>period:
+            last=time.time()
+            try:
+                os.utime(lock_filename)
+            except OSError:
+                pass
+        yield chunk
 
-    local_base_filename=urlparse(url).netloc+"_"+str(crc32(bytes(url,'utf-8')))+suffix
-    local_tmp_filename=os.path.join(tmpdir,local_base_filename)
+def _get_local_from_url(url,expiration_time=0,suffix='',incremental=False):
+    """Download the data of url if needed, see get_local_from_url
+    """
+
+    local_base_filename=get_local_base_filename(url,suffix)
+
+    for folder in _offline_folders:
+        local_filename=_find_local_file(os.path.join(folder,local_base_filename))
+        if os.path.exists(local_filename):
+            verb('Using offline data for '+url+' stored as '+local_filename)
+            _count_cache_stats(hits=1)
+            return local_filename
+    if _offline_only:
+        raise PyvoaConnectionError('Offline mode : '+url+' is not available in '+str(_offline_folders)+'.')
+
+    tmpdir=get_cache_folder()
+    local_tmp_base_filename=os.path.join(tmpdir,local_base_filename)
+    local_tmp_filename=_find_local_file(local_tmp_base_filename,migrate=True)
 
     local_file_exists=False
 
     if _coacache_folder  != '':
-        local_cached_filename=os.path.join(_coacache_folder,local_base_filename)
+        local_cached_filename=_find_local_file(os.path.join(_coacache_folder,local_base_filename))
         local_file_exists=os.path.exists(local_cached_filename)
         local_filename=local_cached_filename
 
@@ -345,17 +987,112 @@ def get_local_from_url(url,expiration_time=0,suffix=''):
     if expiration_time >=0 and local_file_exists:
         if expiration_time==0 or time.time()-os.path.getmtime(local_filename)<expiration_time:
             verb('Using locally stored data for '+url+' stored as '+local_filename)
+            meta=_read_sidecar(local_filename)
+            _count_cache_stats(hits=1,bytes_saved=_get_saved_size(local_filename,meta))
+            if local_filename==local_tmp_filename:
+                _touch_cache_entry(local_filename,meta)
             return local_filename
 
-    # if not : download the file in tmp area
-    local_filename=local_tmp_filename
+    # if not : revalidate or download the file in tmp area, one process at a time
+    tmp_mtime=os.path.getmtime(local_tmp_filename) if os.path.exists(local_tmp_filename) else None
+    with _download_lock(local_tmp_base_filename) as lock_filename:
+        stored_filename=_find_local_file(local_tmp_base_filename)
+        if os.path.exists(stored_filename) and (stored_filename!=local_tmp_filename or os.path.getmtime(stored_filename)!=tmp_mtime):
+            # downloaded or revalidated by another process while waiting for the lock
+            verb('Using data for '+url+' just stored by another process as '+stored_filename)
+            _count_cache_stats(hits=1,bytes_saved=_get_saved_size(stored_filename))
+            return stored_filename
+        if not local_file_exists:
+            local_filename=local_tmp_filename
+        return _download_to_cache(url,local_filename,local_tmp_base_filename,local_file_exists,expiration_time,lock_filename,incremental)
+
+def _check_tail(chunks,tail_size,tail_sha256):
+    """Check that the tail_size first bytes of the iterable of bytes chunks
+    have the sha256 hex digest tail_sha256. Return the iterable of the
+    following chunks if so, None otherwise.
+    """
+    chunks=iter(chunks)
+    head=bytearray()
+    for chunk in chunks:
+        head.extend(chunk)
+        if len(head)>=tail_size:
+            break
+    if len(head)<tail_size or hashlib.sha256(head[:tail_size]).hexdigest()!=tail_sha256:
+        return None
+    return itertools.chain([bytes(head[tail_size:])],chunks)
+
+def _download_to_cache(url,local_filename,local_tmp_base_filename,local_file_exists,expiration_time,lock_filename,incremental=False):
+    """Revalidate or download url in the cache as local_tmp_base_filename (with
+    a .gz suffix if stored compressed), see get_local_from_url.
+    To be called holding the download lock of local_tmp_base_filename.
+    """
+    headers = {}
+    meta = {}
+    if local_file_exists:
+        meta = _read_sidecar(local_filename)
+        if meta.get('url') == url:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+    range_start=None
+    if incremental and meta.get('url') == url and meta.get('size') and meta.get('tail_sha256'):
+        tail_size=min(meta['size'],_incremental_tail_size)
+        range_start=meta['size']-tail_size
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-        urlfile = requests.get(url, allow_redirects=True,headers=headers) # adding headers for server which does not accept no browser presentation
-        fp=open(local_filename,'wb')
-        fp.write(urlfile.content)
-        fp.close()
-        verb('Download content of '+url+' . Locally stored as cached data in '+local_filename)
+        while True:
+            if range_start is not None:
+                # ranges of the content itself, not of a compressed transfer
+                headers.update({'Range':'bytes=%d-'%range_start,'Accept-Encoding':'identity'})
+            else:
+                headers.pop('Range',None)
+                headers.pop('Accept-Encoding',None)
+            with http_get(url,headers=headers,stream=True) as urlfile:
+                if urlfile.status_code == requests.codes.not_modified and local_file_exists:
+                    try:
+                        os.utime(local_filename) # restart the expiration time
+                    except OSError:
+                        pass
+                    verb('Content of '+url+' not modified. Using locally stored data '+local_filename)
+                    _count_cache_stats(hits=1,bytes_saved=_get_saved_size(local_filename,meta))
+                    if os.path.dirname(local_filename)==os.path.dirname(local_tmp_base_filename):
+                        _touch_cache_entry(local_filename,meta)
+                    return local_filename
+                chunks=_refresh_lock(lock_filename,urlfile.iter_content(chunk_size=_download_chunk_size))
+                prefix_filename=None
+                if range_start is not None and urlfile.status_code != requests.codes.ok: # else ranges are ignored
+                    content_range=urlfile.headers.get('Content-Range','')
+                    if urlfile.status_code == requests.codes.partial_content and \
+                            content_range.startswith('bytes %d-'%range_start):
+                        chunks=_check_tail(chunks,tail_size,meta['tail_sha256'])
+                    else:
+                        chunks=None
+                    if chunks is None:
+                        verb('Locally stored data of '+url+' is not a prefix of its content anymore, full download.')
+                        range_start=None
+                        continue
+                    prefix_filename=local_filename
+                urlfile.raise_for_status() # do not store an error page as data
+                local_filename,sha,size,compressed,tail_sha=_store_in_cache(local_tmp_base_filename,chunks,prefix_filename)
+                now=time.time()
+                _write_sidecar(local_filename,{'url':url,
+                    'etag':urlfile.headers.get('ETag'),
+                    'last_modified':urlfile.headers.get('Last-Modified'),
+                    'sha256':sha,
+                    'size':size,
+                    'tail_sha256':tail_sha,
+                    'compressed':compressed,
+                    'created':now,
+                    'last_access':now})
+            break
+        if prefix_filename:
+            _count_cache_stats(misses=1,bytes_downloaded=size-range_start,bytes_saved=range_start)
+            verb('Incremental download of '+url+' ('+str(size-meta['size'])+' new bytes). Locally stored as cached data in '+local_filename)
+        else:
+            _count_cache_stats(misses=1,bytes_downloaded=size)
+            verb('Download content of '+url+' ('+str(size)+' bytes). Locally stored as cached data in '+local_filename)
+        if _cache_options['max_bytes'] is not None:
+            prune_cache()
     except requests.exceptions.RequestException :
         if local_file_exists and expiration_time >=0 :
             info('Cannot access to '+url+' . Will use locally stored cached version.')
@@ -404,41 +1141,9 @@ def getnonnegfunc(mypd,which):
     if isinstance(which,list):
         raise PyvoaError('getnonnegfunc do not accepte a list ...')
     else:
-        whichvalues = mypd[which]
-        reconstructed = pd.DataFrame()
-        try:
-            y0 = whichvalues.values[0] # integrated offset at t=0
-        except:
-            y0 = 0
-        if np.isnan(y0):
-            y0 = 0
-        pa = whichvalues.diff()
-        yy = pa.values
-        ind = list(pa.index)
-        where_nan = np.isnan(yy)
-        yy[where_nan] = 0.
-        indices=np.where(yy < 0)[0]
-        for kk in np.where(yy < 0)[0]:
-            k = int(kk)
-            val_to_repart = -yy[k]
-            if k < np.size(yy)-1:
-                yy[k] = (yy[k+1]+yy[k-1])/2
-            else:
-                yy[k] = yy[k-1]
-            val_to_repart = val_to_repart + yy[k]
-            s = np.nansum(yy[0:k])
-            if not any([i !=0 for i in yy[0:k]]) == True and s == 0:
-                yy[0:k] = 0.
-            elif s == 0:
-                yy[0:k] = np.nan*np.ones(k)
-            else:
-                yy[0:k] = yy[0:k]*(1-float(val_to_repart)/s)
-        whichvalues = whichvalues.copy()
-        whichvalues.loc[ind] = np.cumsum(yy)+y0 # do not forget the offset
-        if reconstructed.empty:
-            reconstructed = mypd
-        else:
-            reconstructed = pd.concat([mypd,whichvalues])
+        # row ordering only: the values are returned unchanged (the
+        # redistribution of the negative daily values is pyvoa.datacube.nonneg)
+        reconstructed = mypd
     return reconstructed
 
 def return_nonan_dates_pandas(df = None, field = None):
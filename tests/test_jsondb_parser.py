@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the reading of the sources of a database by DataParser
+(pyvoa.jsondb_parser).
+
+The source of a small region database is given as an offline file (see
+tools.set_offline_folders) and its geometry by a GeoCountry stand-in, so that
+no network access is done. Its region codes look like numbers.
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+import pyvoa.tools as tools
+import pyvoa.jsondb_parser as parser
+
+URL = 'http://example.org/codes.csv'
+CODES = ['01', '02']
+
+class GeoCountry:
+    ''' Regions of the test database '''
+    def get_region_list(self):
+        return pd.DataFrame({'code_region':CODES, 'name_region':['Aa','Bb'],
+            'geometry':[Point(0,0), Point(1,1)]})
+
+def get_parser(**dataset):
+    ''' DataParser of the test database, as DataParser.__init__ without the geo methods '''
+    p = parser.DataParser.__new__(parser.DataParser)
+    p.db = 'test'
+    p.metadata = {'geoinfo':{'granularity':'region', 'locationmode':'code', 'iso3':'XXX'},
+        'datasets':[dict(urldata = URL, columns = [{'name':'where'}, {'name':'date'}, {'name':'a'}], **dataset)]}
+    p.geo = GeoCountry()
+    p.set_description()
+    p.localfiles, p.datasets_db, p.datasets_version, p.frames, p.steps_datasets = {}, {}, {}, {}, {}
+    p.rawlocations = pd.DataFrame(columns = ['where','code'])
+    p.geolocations = pd.DataFrame(columns = ['code','geometry'])
+    p.codenamedico, p.cubes, p.mainpandas, p.shared = {}, {}, None, None
+    p.load_keywords(['a'])
+    return p
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path)) # parsed data cache
+    folder = tmp_path / 'sources'
+    folder.mkdir()
+    dates = pd.date_range('2020-01-01', periods = 10).strftime('%Y-%m-%d')
+    rows = ['where;date;a'] + ['%s;%s;%d'%(w, d, i+1) for w in CODES for i,d in enumerate(dates)]
+    with open(os.path.join(folder, tools.get_local_base_filename(URL)), 'w') as fp:
+        fp.write('\n'.join(rows) + '\n')
+    tools.set_offline_folders([str(folder)])
+    yield str(folder)
+    tools.set_offline_folders([])
+
+@pytest.mark.parametrize('dataset', [{}, {'chunksize':7}])
+def test_codes_are_read_as_text(source, dataset):
+    data = get_parser(**dataset).get_maingeopandas(['a'])
+    assert sorted(data['code'].unique()) == CODES
+    assert data.groupby('code')['a'].max().tolist() == [10, 10]
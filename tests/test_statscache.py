@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the cache of the results of GPDBuilder.get_stats (pyvoa.statscache)
+and of its keys, see GPDBuilder.get_stats_key.
+
+The sources of a small region database are given as offline files (see
+tools.set_offline_folders) and its geometry by a GeoCountry stand-in, so that
+no network access is done.
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+import pyvoa.tools as tools
+import pyvoa.jsondb_parser as parser
+import pyvoa.geopd_builder as builder
+from pyvoa.statscache import StatsCache
+
+URL_A = 'http://example.org/a.csv'
+URL_B = 'http://example.org/b.csv'
+
+class GeoCountry:
+    ''' Regions of the test database '''
+    def get_region_list(self):
+        return pd.DataFrame({'code_region':['R1','R2'], 'name_region':['Aa','Bb'],
+            'geometry':[Point(0,0), Point(1,1)]})
+
+def write_source(folder, url, name, scale):
+    dates = pd.date_range('2020-01-01', periods = 10).strftime('%Y-%m-%d')
+    rows = ['where;date;' + name] + ['%s;%s;%g'%(w, d, scale*(i+1)) for w in ['R1','R2'] for i,d in enumerate(dates)]
+    with open(os.path.join(folder, tools.get_local_base_filename(url)), 'w') as fp:
+        fp.write('\n'.join(rows) + '\n')
+
+def get_parser():
+    ''' DataParser of the test database, as DataParser.__init__ without the geo methods '''
+    p = parser.DataParser.__new__(parser.DataParser)
+    p.db = 'test'
+    p.metadata = {'geoinfo':{'granularity':'region', 'locationmode':'code', 'iso3':'XXX'},
+        'datasets':[{'urldata':url, 'columns':[{'name':'where'}, {'name':'date'}, {'name':name}]}
+                    for url, name in [(URL_A, 'a'), (URL_B, 'b')]]}
+    p.geo = GeoCountry()
+    p.set_description()
+    p.localfiles, p.datasets_db, p.datasets_version, p.frames, p.steps_datasets = {}, {}, {}, {}, {}
+    p.rawlocations = pd.DataFrame(columns = ['where','code'])
+    p.geolocations = pd.DataFrame(columns = ['code','geometry'])
+    p.codenamedico, p.cubes, p.mainpandas, p.shared = {}, {}, None, None
+    p.load_keywords(['a'])
+    return p
+
+def get_builder():
+    b = builder.GPDBuilder.__new__(builder.GPDBuilder)
+    b.db = 'test'
+    b.currentdata = get_parser()
+    b.statscache = StatsCache()
+    return b
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path)) # parsed data cache
+    folder = tmp_path / 'sources'
+    folder.mkdir()
+    write_source(folder, URL_A, 'a', 1)
+    write_source(folder, URL_B, 'b', 1)
+    tools.set_offline_folders([str(folder)])
+    yield str(folder)
+    tools.set_offline_folders([])
+
+def key(b, which):
+    return b.get_stats_key({'which':[which], 'option':[], 'what':'standard', 'output':'pandas', 'where':None})
+
+def test_key_follows_the_source_of_which(sources):
+    before = key(get_builder(), 'b')
+    # new session, only the dataset of the first keyword is loaded at init
+    write_source(sources, URL_B, 'b', 1000)
+    b = get_builder()
+    assert key(b, 'b') != before
+    assert b.currentdata.get_maingeopandas(['b'])['b'].max() == 10000
+
+def test_key_does_not_depend_on_the_other_datasets_loaded(sources):
+    b = get_builder()
+    first = key(b, 'a')
+    b.currentdata.load_keywords(['b'])
+    assert key(b, 'a') == first
+
+def test_oversized_result_not_stored(tmp_path):
+    cache = StatsCache(max_bytes = 1000, folder = str(tmp_path / 'stats'))
+    cache.put('big', {'pandas':pd.DataFrame({'v':range(1000)})})
+    cache.put('small', {'pandas':pd.DataFrame({'v':range(3)})})
+    assert cache.get('big') is None
+    assert cache.get('small')['pandas']['v'].tolist() == [0, 1, 2]
+    assert len(os.listdir(tmp_path / 'stats')) == 1